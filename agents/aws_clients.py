@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+import boto3
+from botocore.config import Config
+
+# Shared AWS client factory.
+#
+# Clients are created once per (service, region, role) and reused across calls and, in
+# Lambda, across warm invocations. They share one tuned botocore Config: adaptive retries
+# and a connection pool large enough for the thread-pool scans. boto3's default session is
+# not thread-safe for client creation, so creation happens under a lock.
+# The same module lives in agents/ and in the Lambda source directory.
+
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "5"))
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "32"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "5"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "30"))
+# Assumed-role sessions are renewed this long before their credentials expire
+ROLE_REFRESH_MARGIN = timedelta(minutes=5)
+
+CLIENT_CONFIG = Config(
+    retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"},
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+)
+
+_lock = threading.Lock()
+_clients = {}
+_role_sessions = {}
+_stats = {"clients_created": 0, "client_cache_hits": 0, "client_create_ms": 0.0, "roles_assumed": 0}
+
+def _role_session(role_arn):
+    # Returns a boto3 Session for role_arn, assuming the role again when close to expiry.
+    # Callers hold _lock.
+    cached = _role_sessions.get(role_arn)
+    if cached and cached[1] - ROLE_REFRESH_MARGIN > datetime.now(timezone.utc):
+        return cached[0], False
+    sts = boto3.client("sts", config=CLIENT_CONFIG)
+    creds = sts.assume_role(RoleArn=role_arn, RoleSessionName="cloud-native-toolkit")["Credentials"]
+    session = boto3.session.Session(
+        aws_access_key_id=creds["AccessKeyId"],
+        aws_secret_access_key=creds["SecretAccessKey"],
+        aws_session_token=creds["SessionToken"],
+    )
+    _role_sessions[role_arn] = (session, creds["Expiration"])
+    _stats["roles_assumed"] += 1
+    return session, True
+
+def get_client(service, region=None, role_arn=None):
+    key = (service, region, role_arn)
+    with _lock:
+        renewed = False
+        if role_arn:
+            session, renewed = _role_session(role_arn)
+        client = _clients.get(key)
+        if client is not None and not renewed:
+            _stats["client_cache_hits"] += 1
+            return client
+
+        started = time.perf_counter()
+        if role_arn:
+            client = session.client(service, region_name=region, config=CLIENT_CONFIG)
+        else:
+            client = boto3.client(service, region_name=region, config=CLIENT_CONFIG)
+        _stats["client_create_ms"] += (time.perf_counter() - started) * 1000
+        _stats["clients_created"] += 1
+        _clients[key] = client
+        return client
+
+def client_stats():
+    with _lock:
+        return {**_stats, "client_create_ms": round(_stats["client_create_ms"], 1), "cached_clients": len(_clients)}
@@ -1,10 +1,23 @@
 # File: agents/infra_autopilot.py
-import boto3
+import os
+import queue
 import datetime
-from ai.sonar_client import ask_sonar
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ai.sonar_client import ask_sonar, stream_sonar
+from ai.sonar_transport import TokenBucket
+from agents.aws_clients import get_client
+
+# Log groups sampled and summarized at the same time
+AUTOPILOT_CONCURRENCY = int(os.getenv("AUTOPILOT_CONCURRENCY", "8"))
+# CloudWatch Logs throttles DescribeLogStreams/GetLogEvents per account, so every worker
+# shares one limiter; Sonar calls are already limited by the shared transport's bucket
+AUTOPILOT_LOGS_RATE_PER_SECOND = float(os.getenv("AUTOPILOT_LOGS_RATE_PER_SECOND", "5"))
+logs_limiter = TokenBucket(AUTOPILOT_LOGS_RATE_PER_SECOND, max(1, int(AUTOPILOT_LOGS_RATE_PER_SECOND)))
+AUTOPILOT_PREFIXES = ["/aws/lambda/", "/aws/ec2/", "/aws/rds/"]
 
 def get_log_groups(prefixes=None):
-    logs = boto3.client("logs")
+    logs = get_client("logs")
     paginator = logs.get_paginator("describe_log_groups")
     groups = []
     for page in paginator.paginate():
@@ -15,14 +28,16 @@ def get_log_groups(prefixes=None):
     return groups
 
 def sample_logs(log_group, hours=48, limit=100):
-    logs = boto3.client("logs")
+    logs = get_client("logs")
     now = int(datetime.datetime.utcnow().timestamp() * 1000)
     past = now - hours * 3600 * 1000
 
     try:
+        logs_limiter.acquire()
         streams = logs.describe_log_streams(logGroupName=log_group, orderBy="LastEventTime", descending=True)["logStreams"]
         events = []
         for stream in streams[:2]:  # sample 2 streams max
+            logs_limiter.acquire()
             response = logs.get_log_events(
                 logGroupName=log_group,
                 logStreamName=stream["logStreamName"],
@@ -37,23 +52,86 @@ def sample_logs(log_group, hours=48, limit=100):
         print(f"❌ Failed for {log_group}: {e}")
         return []
 
-def generate_autopilot_summary():
-    log_groups = get_log_groups(["/aws/lambda/", "/aws/ec2/", "/aws/rds/"])
-    summaries = []
-
-    for group in log_groups:
-        print(f"🔍 Analyzing {group}...")
-        logs = sample_logs(group)
-        if not logs:
-            continue
+def autopilot_prompt(group):
+    # Returns the Sonar prompt for a log group, or None when it has no recent logs
+    print(f"🔍 Analyzing {group}...")
+    logs = sample_logs(group)
+    if not logs:
+        return None
 
-        prompt = f"""
+    sample = "\n".join(logs[:50])
+    return f"""
 You're an AWS optimization agent. Given the logs below, summarize the activity and suggest if this service is underutilized and can be paused, scaled down, or optimized:
 
 Logs:
-{'\n'.join(logs[:50])}
+{sample}
 """
-        summary = ask_sonar(prompt)
-        summaries.append((group, summary))
 
-    return summaries
+def summarize_log_group(group):
+    # Returns (group, summary), or None when the group has no recent logs
+    prompt = autopilot_prompt(group)
+    if prompt is None:
+        return None
+    return group, ask_sonar(prompt)
+
+def iter_autopilot_summaries(prefixes=None, max_workers=AUTOPILOT_CONCURRENCY):
+    # Sample and summarize log groups concurrently, yielding (group, summary) as each one
+    # completes so callers can render results progressively
+    log_groups = get_log_groups(prefixes or AUTOPILOT_PREFIXES)
+    if not log_groups:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(log_groups))))
+    try:
+        futures = [executor.submit(summarize_log_group, group) for group in log_groups]
+        for future in as_completed(futures):
+            result = future.result()
+            if result:
+                yield result
+    finally:
+        # A consumer that stops early should not leave queued groups running
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_autopilot_stream(prefixes=None, max_workers=AUTOPILOT_CONCURRENCY):
+    # Like iter_autopilot_summaries, but yields (group, chunk) as the summaries stream in.
+    # Chunks of concurrent groups interleave; (group, None) marks the end of a group's summary.
+    log_groups = get_log_groups(prefixes or AUTOPILOT_PREFIXES)
+    if not log_groups:
+        return
+    events = queue.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def stream_group(group):
+        try:
+            prompt = autopilot_prompt(group)
+            if prompt is None:
+                return
+            for chunk in stream_sonar(prompt):
+                if stopped.is_set():
+                    return
+                events.put((group, chunk))
+            events.put((group, None))
+        except Exception as e:
+            events.put((group, f"[Autopilot Error] {e}"))
+            events.put((group, None))
+        finally:
+            events.put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(log_groups))))
+    try:
+        for group in log_groups:
+            executor.submit(stream_group, group)
+        remaining = len(log_groups)
+        while remaining:
+            event = events.get()
+            if event is done:
+                remaining -= 1
+            else:
+                yield event
+    finally:
+        # A consumer that stops early should not leave queued groups running
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def generate_autopilot_summary():
+    return sorted(iter_autopilot_summaries(), key=lambda item: item[0])
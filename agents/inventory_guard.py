@@ -1,7 +1,9 @@
 import os
-import json
-import boto3
-from ai.ask import ask_cost_governance_summary, ask_freeform
+from ai.ask import ask_cost_governance_summary, ask_freeform, stream_freeform
+from ai.prompt_compaction import compact_records, map_reduce_summarize
+from agents.resource_collectors import paginate, iter_instances, iter_volumes, iter_buckets
+from agents.aws_clients import get_client
+from agents.inventory_snapshot import snapshot_and_diff, has_changes
 
 # Optional: fall back to mocked infra if offline/testing
 MOCK_INFRA = {
@@ -19,56 +21,90 @@ MOCK_INFRA = {
     ]
 }
 
-def fetch_live_inventory():
-    try:
-        ec2 = boto3.client('ec2')
-        s3 = boto3.client('s3')
-
-        # Get EC2 instance metadata
-        instances = ec2.describe_instances()
-        instance_data = []
-        for reservation in instances["Reservations"]:
-            for inst in reservation["Instances"]:
-                instance_data.append({
-                    "id": inst["InstanceId"],
-                    "type": inst["InstanceType"],
-                    "state": inst["State"]["Name"],
-                    "port_22_open": check_security_group_for_ssh(inst)
-                })
-
-        # Get unattached volumes
-        volumes = ec2.describe_volumes()
-        volume_data = [{
+def iter_live_inventory(ec2=None, s3=None):
+    # Yields (section, record) pairs while paging through every describe call, so large
+    # accounts are read completely without building the whole inventory first
+    ec2 = ec2 or get_client('ec2')
+    s3 = s3 or get_client('s3')
+
+    # One pass over every security group; instance exposure is then computed locally
+    sg_index = build_security_group_index(ec2)
+
+    # Get EC2 instance metadata
+    for inst in iter_instances(ec2):
+        yield "ec2_instances", {
+            "id": inst["InstanceId"],
+            "type": inst["InstanceType"],
+            "state": inst["State"]["Name"],
+            "port_22_open": check_security_group_for_ssh(inst, sg_index)
+        }
+
+    # Get unattached volumes
+    for v in iter_volumes(ec2):
+        yield "ebs_volumes", {
             "id": v["VolumeId"],
             "size": v["Size"],
             "attached": len(v.get("Attachments", [])) > 0
-        } for v in volumes["Volumes"]]
+        }
 
-        # Check for public buckets
-        buckets = s3.list_buckets()
-        bucket_data = []
-        for b in buckets.get("Buckets", []):
-            name = b["Name"]
-            is_public = is_bucket_public(s3, name)
-            bucket_data.append({"name": name, "public": is_public})
+    # Check for public buckets
+    for b in iter_buckets(s3):
+        name = b["Name"]
+        yield "s3_buckets", {"name": name, "public": is_bucket_public(s3, name)}
 
-        return {
-            "ec2_instances": instance_data,
-            "ebs_volumes": volume_data,
-            "s3_buckets": bucket_data
-        }
+def collect_live_inventory():
+    inventory = {"ec2_instances": [], "ebs_volumes": [], "s3_buckets": []}
+    for section, record in iter_live_inventory():
+        inventory[section].append(record)
+    return inventory
 
-    except Exception as e:
-        print(f"[Error fetching AWS data] {e}")
-        return MOCK_INFRA
+# Protocol numbers AWS may return instead of names
+PROTOCOL_NAMES = {"6": "tcp", "17": "udp", "1": "icmp", "58": "icmpv6"}
+WORLD_CIDRS = {"0.0.0.0/0", "::/0"}
+
+def normalize_permission(perm):
+    # Flatten one IpPermissions entry into a rule with an inclusive port range.
+    # Protocol -1 means every protocol and every port.
+    protocol = str(perm.get("IpProtocol", "-1")).lower()
+    protocol = PROTOCOL_NAMES.get(protocol, protocol)
+    if protocol == "-1":
+        from_port, to_port = 0, 65535
+    else:
+        from_port, to_port = perm.get("FromPort", 0), perm.get("ToPort", 65535)
+        if from_port == -1 or to_port == -1:
+            from_port, to_port = 0, 65535
+    sources = [r["CidrIp"] for r in perm.get("IpRanges", [])]
+    sources += [r["CidrIpv6"] for r in perm.get("Ipv6Ranges", [])]
+    return {
+        "protocol": protocol,
+        "from_port": from_port,
+        "to_port": to_port,
+        "sources": sources,
+        "open_to_world": any(cidr in WORLD_CIDRS for cidr in sources),
+    }
+
+def build_security_group_index(ec2):
+    # {group id: [normalized ingress rules]} from a single paginated describe_security_groups pass
+    index = {}
+    for sg in paginate(ec2, "describe_security_groups", "SecurityGroups"):
+        index[sg["GroupId"]] = [normalize_permission(perm) for perm in sg.get("IpPermissions", [])]
+    return index
 
-def check_security_group_for_ssh(instance):
+def rule_exposes_port(rule, port, protocol="tcp"):
+    return (
+        rule["open_to_world"]
+        and rule["protocol"] in ("-1", protocol)
+        and rule["from_port"] <= port <= rule["to_port"]
+    )
+
+def check_security_group_for_ssh(instance, sg_index=None, port=22):
+    # True if any of the instance's security groups opens the port to 0.0.0.0/0 or ::/0
     try:
+        if sg_index is None:
+            sg_index = build_security_group_index(get_client('ec2'))
         for sg in instance.get("SecurityGroups", []):
-            ec2 = boto3.client('ec2')
-            resp = ec2.describe_security_groups(GroupIds=[sg["GroupId"]])
-            for perm in resp["SecurityGroups"][0]["IpPermissions"]:
-                if perm.get("FromPort") == 22 and perm.get("ToPort") == 22:
+            for rule in sg_index.get(sg["GroupId"], []):
+                if rule_exposes_port(rule, port):
                     return True
     except Exception:
         return False
@@ -84,13 +120,85 @@ def is_bucket_public(s3_client, bucket_name):
         return False
     return False
 
-def summarize_inventory():
-    inventory = fetch_live_inventory()
-    inventory_json = json.dumps(inventory, indent=2)
-    summary = ask_freeform(f"Analyze this AWS inventory and identify any risks or cost issues:\n\n```json\n{inventory_json}\n```")
+def compact_inventory(inventory):
+    # One flat list tagged by section; resources that differ only by id/name are folded into counted groups
+    records = [{"section": section, **record} for section, records in inventory.items() for record in records]
+    return compact_records(records, identity_fields=("id", "name"))
+
+def summarize_full_inventory(inventory, stream=False):
+    def build_prompt(data, part):
+        scope = f" (part {part} of a larger inventory)" if part else ""
+        return (
+            f"Analyze this AWS inventory{scope} and identify any risks or cost issues. "
+            f"Identical resources are folded into groups with a count and sample ids:\n\n```json\n{data}\n```"
+        )
+    return map_reduce_summarize(compact_inventory(inventory), build_prompt, ask_freeform, final_ask=stream_freeform if stream else None)
+
+def commit_snapshot(summary, commit):
+    # A failed summary keeps the previous snapshot, so the same changes are offered again next run
+    if commit is None or "[Sonar API Error]" in summary:
+        return
+    try:
+        commit()
+    except Exception as e:
+        print(f"[Inventory snapshot not saved] {e}")
+
+def commit_after_summary(summary, commit, stream):
+    if not stream:
+        commit_snapshot(summary, commit)
+        return summary
+
+    def chunks():
+        # The snapshot is saved only once the whole summary has streamed
+        parts = []
+        for chunk in summary:
+            parts.append(chunk)
+            yield chunk
+        commit_snapshot("".join(parts), commit)
+    return chunks()
+
+def summarize_inventory(full=False, stream=False):
+    # Incremental by default: only resources added, removed or changed since the previous
+    # snapshot are sent to the model. The first run (no snapshot yet), full=True, mock data
+    # or an unavailable snapshot store fall back to summarizing the whole inventory.
+    # With stream=True, "summary" is a generator of text chunks instead of a string.
+    try:
+        inventory = collect_live_inventory()
+    except Exception as e:
+        print(f"[Error fetching AWS data] {e}")
+        inventory, full = MOCK_INFRA, True
+
+    previous, commit = None, None
+    if not full:
+        try:
+            delta, previous, commit = snapshot_and_diff(inventory)
+        except Exception as e:
+            print(f"[Inventory snapshot unavailable] {e}")
+
+    if previous is None:
+        return {
+            "summary": commit_after_summary(summarize_full_inventory(inventory, stream=stream), commit, stream),
+            "raw": inventory  # Optionally return for frontend expansion
+        }
+
+    if not has_changes(delta):
+        summary = f"No inventory changes since {previous['taken_at']} ({delta['unchanged']} resources unchanged)."
+        if stream:
+            summary = iter([summary])
+    else:
+        changes = [{"change": kind, **entry} for kind in ("added", "removed", "changed") for entry in delta[kind]]
+
+        def build_prompt(data, part):
+            scope = f" (part {part})" if part else ""
+            return (
+                f"These AWS inventory resources were added, removed or changed since {previous['taken_at']}{scope} "
+                f"({delta['unchanged']} other resources are unchanged). Identify any new risks or cost issues:\n\n```json\n{data}\n```"
+            )
+        summary = map_reduce_summarize(changes, build_prompt, ask_freeform, final_ask=stream_freeform if stream else None)
     return {
-        "summary": summary,
-        "raw": inventory  # Optionally return for frontend expansion
+        "summary": commit_after_summary(summary, commit, stream),
+        "changes": delta,
+        "since": previous["taken_at"]
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime, timezone
+from agents.aws_clients import get_client
+
+# Content-addressed inventory snapshots for incremental inventory summaries.
+#
+#   <store>/objects/<sha256>.json   one normalized resource, written once per distinct content
+#   <store>/latest.json             manifest of the last run: {"taken_at", "resources": {key: {"section", "hash"}}}
+#
+# The store is S3 when INVENTORY_SNAPSHOT_BUCKET is set, otherwise a local directory
+# (INVENTORY_SNAPSHOT_DIR, default .inventory_snapshots/ at the repo root). A resource key is
+# its section plus its id (or bucket name), so a changed resource keeps its key and gets a new hash.
+
+INVENTORY_SNAPSHOT_BUCKET = os.environ.get("INVENTORY_SNAPSHOT_BUCKET", "")
+INVENTORY_SNAPSHOT_PREFIX = os.environ.get("INVENTORY_SNAPSHOT_PREFIX", "inventory_snapshots/")
+INVENTORY_SNAPSHOT_DIR = os.environ.get(
+    "INVENTORY_SNAPSHOT_DIR",
+    str(Path(__file__).resolve().parent.parent / ".inventory_snapshots")
+)
+
+def resource_key(section, record):
+    return f"{section}/{record.get('id') or record.get('name')}"
+
+def content_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class LocalSnapshotStore:
+    def __init__(self, root=INVENTORY_SNAPSHOT_DIR):
+        self.root = Path(root)
+
+    def read(self, name):
+        path = self.root / name
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def write(self, name, payload):
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a truncated manifest behind
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(payload, default=str))
+        tmp.replace(path)
+
+class S3SnapshotStore:
+    def __init__(self, bucket=INVENTORY_SNAPSHOT_BUCKET, prefix=INVENTORY_SNAPSHOT_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = get_client("s3")
+
+    def read(self, name):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{name}")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+
+    def write(self, name, payload):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{name}",
+            Body=json.dumps(payload, default=str).encode("utf-8"),
+            ContentType="application/json"
+        )
+
+def default_store():
+    return S3SnapshotStore() if INVENTORY_SNAPSHOT_BUCKET else LocalSnapshotStore()
+
+def index_inventory(inventory):
+    # {key: (section, hash, record)} for an inventory dict of section -> [records]
+    indexed = {}
+    for section, records in inventory.items():
+        for record in records:
+            indexed[resource_key(section, record)] = (section, content_hash(record), record)
+    return indexed
+
+def diff_inventory(store, previous, current):
+    # Compare the current index against the previous manifest. Old record bodies are only
+    # read for removed and changed resources, so an unchanged account costs one manifest read.
+    previous_resources = previous["resources"] if previous else {}
+    delta = {"added": [], "removed": [], "changed": [], "unchanged": 0}
+    for key, (section, digest, record) in current.items():
+        before = previous_resources.get(key)
+        if before is None:
+            delta["added"].append({"key": key, "section": section, "record": record})
+        elif before["hash"] != digest:
+            delta["changed"].append({
+                "key": key,
+                "section": section,
+                "before": store.read(f"objects/{before['hash']}.json"),
+                "after": record,
+            })
+        else:
+            delta["unchanged"] += 1
+    for key, before in previous_resources.items():
+        if key not in current:
+            delta["removed"].append({
+                "key": key,
+                "section": before["section"],
+                "record": store.read(f"objects/{before['hash']}.json"),
+            })
+    return delta
+
+def has_changes(delta):
+    return bool(delta["added"] or delta["removed"] or delta["changed"])
+
+def save_snapshot(store, previous, current):
+    # Only content not referenced by the previous manifest is written
+    known = {entry["hash"] for entry in (previous or {}).get("resources", {}).values()}
+    for section, digest, record in current.values():
+        if digest not in known:
+            store.write(f"objects/{digest}.json", record)
+            known.add(digest)
+    manifest = {
+        "taken_at": datetime.now(timezone.utc).isoformat(),
+        "resources": {key: {"section": section, "hash": digest} for key, (section, digest, _) in current.items()},
+    }
+    store.write("latest.json", manifest)
+    return manifest
+
+def snapshot_and_diff(inventory, store=None):
+    # Returns (delta, previous manifest or None, commit). Nothing is saved until commit() is
+    # called, so callers can keep the previous snapshot when the delta was never summarized.
+    store = store or default_store()
+    previous = store.read("latest.json")
+    current = index_inventory(inventory)
+    delta = diff_inventory(store, previous, current)
+    return delta, previous, lambda: save_snapshot(store, previous, current)
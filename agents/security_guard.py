@@ -1,56 +1,395 @@
 # Unlike inventory guard, this file runs wrapped in lambda so that it can securely access and handle information in the cloud rather than locally.
 
-import boto3
+import os
+import io
+import csv
+import bisect
+import time
+import urllib.parse
 import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from agents.aws_clients import get_client
 from ai.ask import ask_freeform
 
+S3_SCAN_WORKERS = int(os.environ.get("S3_SCAN_WORKERS", "16"))
+def error_code(e):
+    return e.response.get("Error", {}).get("Code", "") if isinstance(e, ClientError) else ""
+
+def check_bucket_exposure(s3, name):
+    # A bucket is public if a public ACL grant is not neutralized by IgnorePublicAcls, or a public
+    # bucket policy is not neutralized by RestrictPublicBuckets. The verdict records which signal fired.
+    verdict = {"BucketName": name, "Public": False, "TriggeredBy": [], "PublicAccessBlock": None, "Errors": {}}
+
+    try:
+        pab = s3.get_public_access_block(Bucket=name)["PublicAccessBlockConfiguration"]
+        verdict["PublicAccessBlock"] = pab
+    except Exception as e:
+        pab = {}
+        if error_code(e) != "NoSuchPublicAccessBlockConfiguration":
+            verdict["Errors"]["public_access_block"] = str(e)
+
+    try:
+        acl = s3.get_bucket_acl(Bucket=name)
+        acl_public = any(
+            grant["Grantee"].get("URI", "").endswith(("AllUsers", "AuthenticatedUsers"))
+            for grant in acl.get("Grants", [])
+        )
+        if acl_public and not pab.get("IgnorePublicAcls"):
+            verdict["TriggeredBy"].append("acl")
+    except Exception as e:
+        verdict["Errors"]["acl"] = str(e)
+
+    try:
+        status = s3.get_bucket_policy_status(Bucket=name)
+        if status["PolicyStatus"].get("IsPublic") and not pab.get("RestrictPublicBuckets"):
+            verdict["TriggeredBy"].append("policy")
+    except Exception as e:
+        if error_code(e) != "NoSuchBucketPolicy":
+            verdict["Errors"]["policy_status"] = str(e)
+
+    verdict["Public"] = bool(verdict["TriggeredBy"])
+    return verdict
+
+def scan_bucket_exposure():
+    # Check every bucket concurrently; the shared client's pool is sized for concurrent scans
+    s3 = get_client("s3")
+    names = [b["Name"] for b in s3.list_buckets().get("Buckets", [])]
+    if not names:
+        return []
+    with ThreadPoolExecutor(max_workers=min(S3_SCAN_WORKERS, len(names))) as pool:
+        return list(pool.map(lambda name: check_bucket_exposure(s3, name), names))
+
 def get_public_s3_buckets():
-    s3 = boto3.client("s3")
-    public_buckets = []
+    return [
+        {"BucketName": v["BucketName"], "TriggeredBy": v["TriggeredBy"], "PublicAccessBlock": v["PublicAccessBlock"]}
+        for v in scan_bucket_exposure()
+        if v["Public"]
+    ]
 
-    for bucket in s3.list_buckets()["Buckets"]:
-        try:
-            acl = s3.get_bucket_acl(Bucket=bucket["Name"])
-            for grant in acl.get("Grants", []):
-                if grant["Grantee"].get("URI", "").endswith("AllUsers"):
-                    public_buckets.append(bucket["Name"])
-                    break
-        except Exception:
+# Risky-port rule packs. Each entry is {"name", "ports": "22" or "5900-5903", "protocol": "tcp" | "udp" | "any"}.
+# SECURITY_RULE_PACKS selects the enabled packs; SECURITY_RULE_PACK_FILE may point to a JSON
+# file of extra packs in the same shape, which can also override the built-in ones.
+BUILTIN_RULE_PACKS = {
+    "remote-admin": [
+        {"name": "SSH", "ports": "22", "protocol": "tcp"},
+        {"name": "Telnet", "ports": "23", "protocol": "tcp"},
+        {"name": "RDP", "ports": "3389", "protocol": "any"},
+        {"name": "VNC", "ports": "5900-5903", "protocol": "tcp"},
+        {"name": "WinRM", "ports": "5985-5986", "protocol": "tcp"},
+    ],
+    "web": [
+        {"name": "HTTP", "ports": "80", "protocol": "tcp"},
+        {"name": "HTTPS", "ports": "443", "protocol": "tcp"},
+    ],
+    "databases": [
+        {"name": "MSSQL", "ports": "1433", "protocol": "tcp"},
+        {"name": "Oracle", "ports": "1521", "protocol": "tcp"},
+        {"name": "MySQL", "ports": "3306", "protocol": "tcp"},
+        {"name": "PostgreSQL", "ports": "5432", "protocol": "tcp"},
+        {"name": "Redis", "ports": "6379", "protocol": "tcp"},
+        {"name": "Elasticsearch", "ports": "9200-9300", "protocol": "tcp"},
+        {"name": "Memcached", "ports": "11211", "protocol": "any"},
+        {"name": "MongoDB", "ports": "27017-27019", "protocol": "tcp"},
+    ],
+}
+SECURITY_RULE_PACKS = [p.strip() for p in os.environ.get("SECURITY_RULE_PACKS", "remote-admin,web,databases").split(",") if p.strip()]
+SECURITY_RULE_PACK_FILE = os.environ.get("SECURITY_RULE_PACK_FILE", "")
+PROTOCOL_NAMES = {"6": "tcp", "17": "udp", "1": "icmp", "58": "icmpv6"}
+WORLD_CIDRS = {"0.0.0.0/0", "::/0"}
+# Protocols a rule entry may name; "any" means tcp and udp. For ICMP, "ports" are ICMP types
+# and may be omitted to cover every type.
+RULE_PROTOCOLS = {"tcp", "udp", "icmp", "icmpv6", "any"}
+ICMP_PROTOCOLS = {"icmp", "icmpv6"}
+
+class CompiledRules:
+    # Rule entries compiled into sorted, disjoint port segments per protocol, each carrying
+    # every entry that covers it. A permission's port range is matched with two bisects
+    # plus the overlapping segments, instead of a scan over every entry.
+
+    def __init__(self, packs):
+        # packs come from load_rule_packs, so every entry is already validated
+        entries = {"tcp": [], "udp": []}
+        for pack_name, pack in packs.items():
+            for entry in pack:
+                low, _, high = str(entry["ports"]).partition("-")
+                low, high = int(low), int(high or low)
+                protocol = entry.get("protocol", "tcp").lower()
+                for proto in (("tcp", "udp") if protocol == "any" else (protocol,)):
+                    entries.setdefault(proto, []).append((low, high, {"Name": entry["name"], "Pack": pack_name, "Ports": entry["ports"]}))
+        self.segments = {proto: self._compile(items) for proto, items in entries.items()}
+
+    @staticmethod
+    def _compile(items):
+        # Sweep the entry boundaries into disjoint [start, end] segments
+        bounds = sorted({low for low, _, _ in items} | {high + 1 for _, high, _ in items})
+        starts, ends, labels = [], [], []
+        for start, next_start in zip(bounds, bounds[1:]):
+            covering = [label for low, high, label in items if low <= start <= high]
+            if covering:
+                starts.append(start)
+                ends.append(next_start - 1)
+                labels.append(covering)
+        return starts, ends, labels
+
+    def match(self, protocol, from_port, to_port):
+        # Every rule entry overlapping [from_port, to_port] for the protocol ("-1" means all)
+        matches = []
+        for proto in (tuple(self.segments) if protocol == "-1" else (protocol,)):
+            if proto not in self.segments:
+                continue
+            starts, ends, labels = self.segments[proto]
+            i = max(bisect.bisect_right(starts, from_port) - 1, 0)
+            while i < len(starts) and starts[i] <= to_port:
+                if ends[i] >= from_port:
+                    for label in labels[i]:
+                        match = {**label, "Protocol": proto}
+                        if match not in matches:
+                            matches.append(match)
+                i += 1
+        return matches
+
+_compiled_rules = None
+
+def validate_rule_entry(entry):
+    # Returns the entry with a normalized protocol and ports, or raises ValueError
+    if not isinstance(entry, dict) or not entry.get("name"):
+        raise ValueError("entry needs a name")
+    protocol = str(entry.get("protocol", "tcp")).lower()
+    if protocol not in RULE_PROTOCOLS:
+        raise ValueError(f"unsupported protocol {protocol!r}")
+    highest = 255 if protocol in ICMP_PROTOCOLS else 65535
+    ports = str(entry.get("ports", f"0-{highest}" if protocol in ICMP_PROTOCOLS else ""))
+    low, _, high = ports.partition("-")
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise ValueError(f"invalid ports {ports!r}")
+    if not 0 <= low <= high <= highest:
+        raise ValueError(f"ports {ports!r} out of range")
+    return {**entry, "protocol": protocol, "ports": ports}
+
+def load_rule_packs():
+    packs = dict(BUILTIN_RULE_PACKS)
+    if SECURITY_RULE_PACK_FILE:
+        with open(SECURITY_RULE_PACK_FILE) as f:
+            packs.update(json.load(f))
+    unknown = [name for name in SECURITY_RULE_PACKS if name not in packs]
+    if unknown:
+        print(f"⚠️ Unknown security rule packs ignored: {', '.join(unknown)}")
+    # One bad entry in a custom pack must not break every scan in the container
+    selected = {}
+    for name in SECURITY_RULE_PACKS:
+        if name not in packs:
             continue
+        selected[name] = []
+        for entry in packs[name]:
+            try:
+                selected[name].append(validate_rule_entry(entry))
+            except ValueError as e:
+                print(f"⚠️ Rule {entry!r} in pack {name} ignored: {e}")
+    return selected
+
+def get_compiled_rules():
+    # Compiled once per warm container
+    global _compiled_rules
+    if _compiled_rules is None:
+        _compiled_rules = CompiledRules(load_rule_packs())
+    return _compiled_rules
 
-    return public_buckets
+def permission_port_range(perm):
+    protocol = str(perm.get("IpProtocol", "-1")).lower()
+    protocol = PROTOCOL_NAMES.get(protocol, protocol)
+    from_port, to_port = perm.get("FromPort", 0), perm.get("ToPort", 65535)
+    if protocol in ICMP_PROTOCOLS:
+        # FromPort is the ICMP type and ToPort the code; type -1 means every type
+        return (protocol, 0, 255) if from_port == -1 else (protocol, from_port, from_port)
+    if protocol == "-1" or from_port == -1 or to_port == -1:
+        from_port, to_port = 0, 65535
+    return protocol, from_port, to_port
+
+def world_open_prefix_lists(ec2, prefix_list_ids):
+    # Prefix lists whose entries include 0.0.0.0/0 or ::/0; each list is resolved once per scan
+    open_lists = set()
+    for pl_id in prefix_list_ids:
+        try:
+            paginator = ec2.get_paginator("get_managed_prefix_list_entries")
+            for page in paginator.paginate(PrefixListId=pl_id):
+                if any(e.get("Cidr") in WORLD_CIDRS for e in page.get("Entries", [])):
+                    open_lists.add(pl_id)
+                    break
+        except Exception as e:
+            print(f"Could not resolve prefix list {pl_id}: {e}")
+    return open_lists
 
 def get_open_security_groups():
-    ec2 = boto3.client("ec2")
-    risky_sgs = []
+    ec2 = get_client("ec2")
+    rules = get_compiled_rules()
+    groups = []
+    for page in ec2.get_paginator("describe_security_groups").paginate():
+        groups.extend(page["SecurityGroups"])
+
+    prefix_list_ids = {pl["PrefixListId"] for sg in groups for perm in sg.get("IpPermissions", []) for pl in perm.get("PrefixListIds", [])}
+    open_prefix_lists = world_open_prefix_lists(ec2, prefix_list_ids)
 
-    resp = ec2.describe_security_groups()
-    for sg in resp["SecurityGroups"]:
+    risky_sgs = []
+    for sg in groups:
         for perm in sg.get("IpPermissions", []):
-            for ip_range in perm.get("IpRanges", []):
-                if ip_range.get("CidrIp") == "0.0.0.0/0":
-                    port = perm.get("FromPort")
-                    if port in [22, 3389, 80, 443]:  # Common risky ports
-                        risky_sgs.append({
-                            "GroupId": sg["GroupId"],
-                            "GroupName": sg.get("GroupName"),
-                            "Port": port,
-                            "Protocol": perm.get("IpProtocol"),
-                        })
+            sources = [r["CidrIp"] for r in perm.get("IpRanges", []) if r.get("CidrIp") in WORLD_CIDRS]
+            sources += [r["CidrIpv6"] for r in perm.get("Ipv6Ranges", []) if r.get("CidrIpv6") in WORLD_CIDRS]
+            sources += [pl["PrefixListId"] for pl in perm.get("PrefixListIds", []) if pl["PrefixListId"] in open_prefix_lists]
+            if not sources:
+                continue
+            protocol, from_port, to_port = permission_port_range(perm)
+            matches = rules.match(protocol, from_port, to_port)
+            if matches:
+                risky_sgs.append({
+                    "GroupId": sg["GroupId"],
+                    "GroupName": sg.get("GroupName"),
+                    "Port": from_port if from_port == to_port else f"{from_port}-{to_port}",
+                    "Protocol": perm.get("IpProtocol"),
+                    "Sources": sources,
+                    "MatchedPorts": matches,
+                })
     return risky_sgs
 
-def get_risky_iam_users():
-    iam = boto3.client("iam")
-    risky_users = []
+ADMIN_POLICY_SUFFIX = ":policy/AdministratorAccess"
+
+def decode_policy_document(doc):
+    # boto3 usually decodes IAM policy documents already; raw API responses are URL-encoded JSON
+    if isinstance(doc, str):
+        return json.loads(urllib.parse.unquote(doc))
+    return doc or {}
+
+def grants_full_admin(doc):
+    statements = decode_policy_document(doc).get("Statement", [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    for stmt in statements:
+        if stmt.get("Effect") != "Allow" or "NotAction" in stmt:
+            continue
+        actions = stmt.get("Action", [])
+        resources = stmt.get("Resource", [])
+        actions = [actions] if isinstance(actions, str) else actions
+        resources = [resources] if isinstance(resources, str) else resources
+        if "*" in actions and "*" in resources:
+            return True
+    return False
+
+def load_credential_report(iam, max_wait_seconds=10):
+    # ({user name: row}, generated time) from the account credential report, or (None, None)
+    # if it is not ready in time. IAM reuses a report for up to 4 hours, so rows can be stale.
+    deadline = time.time() + max_wait_seconds
+    while iam.generate_credential_report()["State"] != "COMPLETE":
+        if time.time() > deadline:
+            return None, None
+        time.sleep(0.5)
+    report = iam.get_credential_report()
+    content = report["Content"]
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    return {row["user"]: row for row in csv.DictReader(io.StringIO(content))}, report.get("GeneratedTime")
 
-    users = iam.list_users()["Users"]
-    for user in users:
-        mfa = iam.list_mfa_devices(UserName=user["UserName"])
-        attached = iam.list_attached_user_policies(UserName=user["UserName"])
+def load_assigned_mfa_users(iam):
+    # Users with an assigned virtual MFA device, from one paginated listing for the whole account
+    users = set()
+    for page in iam.get_paginator("list_virtual_mfa_devices").paginate(AssignmentStatus="Assigned"):
+        for device in page.get("VirtualMFADevices", []):
+            if device.get("User"):
+                users.add(device["User"]["UserName"])
+    return users
+
+def report_covers(user, snapshot):
+    # True when the credential report has a row for the user that is newer than the user
+    generated = snapshot["credentials_generated_at"]
+    if snapshot["credentials"] is None or user["UserName"] not in snapshot["credentials"]:
+        return False
+    created = user.get("CreateDate")
+    return generated is None or created is None or created <= generated
+
+def load_iam_snapshot():
+    # One paginated get_account_authorization_details pass plus the credential report,
+    # indexed by user, group and role; the number of API calls grows with pages, not users.
+    iam = get_client("iam")
+    snapshot = {
+        "users": {}, "groups": {}, "roles": {}, "policies": {},
+        "credentials": None, "credentials_generated_at": None, "mfa_users": None, "mfa_listed_at": None,
+    }
+    paginator = iam.get_paginator("get_account_authorization_details")
+    for page in paginator.paginate(Filter=["User", "Group", "Role", "LocalManagedPolicy"]):
+        for user in page.get("UserDetailList", []):
+            snapshot["users"][user["UserName"]] = user
+        for group in page.get("GroupDetailList", []):
+            snapshot["groups"][group["GroupName"]] = group
+        for role in page.get("RoleDetailList", []):
+            snapshot["roles"][role["RoleName"]] = role
+        for policy in page.get("Policies", []):
+            default = next((v for v in policy.get("PolicyVersionList", []) if v.get("IsDefaultVersion")), None)
+            snapshot["policies"][policy["Arn"]] = default["Document"] if default else {}
+
+    try:
+        snapshot["credentials"], snapshot["credentials_generated_at"] = load_credential_report(iam)
+    except Exception as e:
+        print(f"Credential report unavailable: {e}")
+    # The live listing settles users the report cannot: no report, no row (created since),
+    # or no MFA in the report (it may have been enabled since). It only sees virtual devices.
+    if any(
+        not report_covers(user, snapshot) or snapshot["credentials"][name].get("mfa_active") != "true"
+        for name, user in snapshot["users"].items()
+    ):
+        try:
+            snapshot["mfa_users"] = load_assigned_mfa_users(iam)
+            snapshot["mfa_listed_at"] = datetime.now(timezone.utc)
+        except Exception as e:
+            print(f"Assigned MFA listing unavailable: {e}")
+    return snapshot
+
+def admin_sources(attached, inline, snapshot):
+    # Names of the managed or inline policies that grant full admin
+    sources = []
+    for policy in attached:
+        arn = policy["PolicyArn"]
+        if arn.endswith(ADMIN_POLICY_SUFFIX) or grants_full_admin(snapshot["policies"].get(arn)):
+            sources.append(policy["PolicyName"])
+    for policy in inline:
+        if grants_full_admin(policy.get("PolicyDocument")):
+            sources.append(f"inline:{policy['PolicyName']}")
+    return sources
+
+def user_mfa_status(name, user, snapshot):
+    # (has MFA, time the answer was observed)
+    row = (snapshot["credentials"] or {}).get(name, {})
+    if report_covers(user, snapshot) and row.get("mfa_active") == "true":
+        return True, snapshot["credentials_generated_at"]
+    if snapshot["mfa_users"] is not None:
+        return name in snapshot["mfa_users"], snapshot["mfa_listed_at"]
+    return row.get("mfa_active") == "true", snapshot["credentials_generated_at"]
+
+def get_risky_iam_users(snapshot=None):
+    # Each entry carries MfaCheckedAt, the time of the data its MFA verdict came from
+    # (the credential report can be hours old)
+    snapshot = snapshot or load_iam_snapshot()
+    risky_users = []
+    for name, user in snapshot["users"].items():
+        reasons = []
+        has_mfa, checked_at = user_mfa_status(name, user, snapshot)
+        if not has_mfa:
+            reasons.append("no_mfa")
 
-        if not mfa["MFADevices"] or any("AdministratorAccess" in p["PolicyArn"] for p in attached.get("AttachedPolicies", [])):
-            risky_users.append(user["UserName"])
+        for source in admin_sources(user.get("AttachedManagedPolicies", []), user.get("UserPolicyList", []), snapshot):
+            reasons.append(f"admin:{source}")
+        for group_name in user.get("GroupList", []):
+            group = snapshot["groups"].get(group_name, {})
+            for source in admin_sources(group.get("AttachedManagedPolicies", []), group.get("GroupPolicyList", []), snapshot):
+                reasons.append(f"admin:group:{group_name}:{source}")
 
+        if reasons:
+            risky_users.append({
+                "UserName": name,
+                "Reasons": reasons,
+                "MfaCheckedAt": checked_at.isoformat() if checked_at else None,
+            })
     return risky_users
 
 def summarize_risks(buckets, sgs, iam_users):
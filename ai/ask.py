@@ -1,10 +1,13 @@
 # File: ai/ask.py
 
-from ai.sonar_client import ask_sonar
+from ai.sonar_client import ask_sonar, stream_sonar
+
+# Each helper has a stream_* twin that yields the answer in chunks as Sonar generates it,
+# built from the same prompt.
 
 # ✅ Original: Cost summary based on raw data
-def ask_cost_governance_summary(cost_data: str) -> str:
-    prompt = f"""Analyze the following AWS cost or resource data and identify:
+def cost_governance_prompt(cost_data: str) -> str:
+    return f"""Analyze the following AWS cost or resource data and identify:
     - Any spikes or anomalies
     - Untagged or potentially orphaned services
     - Suggestions for cost optimization or tagging improvements
@@ -14,17 +17,25 @@ def ask_cost_governance_summary(cost_data: str) -> str:
     ```
     Provide your answer in markdown format with clear headings.
     """
-    return ask_sonar(prompt)
+
+def ask_cost_governance_summary(cost_data: str) -> str:
+    return ask_sonar(cost_governance_prompt(cost_data))
+
+def stream_cost_governance_summary(cost_data: str):
+    return stream_sonar(cost_governance_prompt(cost_data))
 
 
 # ✅ Original: Freeform user queries
 def ask_freeform(question: str) -> str:
     return ask_sonar(question)
 
+def stream_freeform(question: str):
+    return stream_sonar(question)
+
 
 # ✅ New: Highlight security issues in AWS resource configs
-def ask_infra_risks(resource_snapshot: str) -> str:
-    prompt = f"""Examine the following AWS infrastructure snapshot and identify:
+def infra_risks_prompt(resource_snapshot: str) -> str:
+    return f"""Examine the following AWS infrastructure snapshot and identify:
     - Publicly exposed resources (S3, EC2, RDS, etc.)
     - Over-permissive IAM policies
     - Known misconfigurations or best practice violations
@@ -34,12 +45,17 @@ def ask_infra_risks(resource_snapshot: str) -> str:
     ```
     Output your response in markdown format with sections: Risks, Examples, Recommendations.
     """
-    return ask_sonar(prompt)
+
+def ask_infra_risks(resource_snapshot: str) -> str:
+    return ask_sonar(infra_risks_prompt(resource_snapshot))
+
+def stream_infra_risks(resource_snapshot: str):
+    return stream_sonar(infra_risks_prompt(resource_snapshot))
 
 
 # ✅ New: Cost comparison across snapshots
-def ask_cost_change_summary(before: str, after: str) -> str:
-    prompt = f"""Compare these two AWS cost reports:
+def cost_change_prompt(before: str, after: str) -> str:
+    return f"""Compare these two AWS cost reports:
 
     -- BEFORE:
     ```json
@@ -54,12 +70,17 @@ def ask_cost_change_summary(before: str, after: str) -> str:
     Identify key changes in services, cost spikes or drops, and tag/resource hygiene changes.
     Return a bullet-point summary in markdown format with helpful recommendations.
     """
-    return ask_sonar(prompt)
+
+def ask_cost_change_summary(before: str, after: str) -> str:
+    return ask_sonar(cost_change_prompt(before, after))
+
+def stream_cost_change_summary(before: str, after: str):
+    return stream_sonar(cost_change_prompt(before, after))
 
 
 # ✅ New: Budget-based infra plan for students/solo startups
-def ask_startup_plan(budget_usd: int) -> str:
-    prompt = f"""You're advising a student startup that has ${budget_usd} per month to spend on AWS.
+def startup_plan_prompt(budget_usd: int) -> str:
+    return f"""You're advising a student startup that has ${budget_usd} per month to spend on AWS.
 
     Recommend:
     - Cost-effective services to use (compute, DB, storage, etc.)
@@ -69,4 +90,9 @@ def ask_startup_plan(budget_usd: int) -> str:
 
     Keep your answer clear and markdown-formatted.
     """
-    return ask_sonar(prompt)
+
+def ask_startup_plan(budget_usd: int) -> str:
+    return ask_sonar(startup_plan_prompt(budget_usd))
+
+def stream_startup_plan(budget_usd: int):
+    return stream_sonar(startup_plan_prompt(budget_usd))
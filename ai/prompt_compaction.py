@@ -0,0 +1,116 @@
+# File: ai/prompt_compaction.py
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# Prompt compaction and map-reduce summarization for large resource listings.
+#
+# Records are projected onto the fields that matter for the analysis, and near-identical
+# records (equal apart from identity fields such as ids and launch times) are folded into one
+# group with a count and sample ids. The result is serialized as minified JSON. If the
+# estimated prompt is still over PROMPT_TOKEN_BUDGET, the records are split into chunks that
+# are summarized in parallel, and the partial answers are merged with one more call.
+# The same module lives in ai/ and in the Lambda source directory.
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_MAP_WORKERS = int(os.getenv("PROMPT_MAP_WORKERS", "4"))
+# Sample ids kept per folded group
+FOLD_SAMPLE_IDS = 5
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English and JSON; good enough for budgeting
+    return len(text) // 4 + 1
+
+def minify(data):
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+def _lookup(record, path):
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def project(record, fields):
+    # Keep only fields (dotted paths flatten nested keys); AWS Tags lists become {Key: Value}
+    out = {}
+    for path in fields:
+        value = _lookup(record, path)
+        if value is None or value == [] or value == {}:
+            continue
+        if path.split(".")[-1] == "Tags" and isinstance(value, list):
+            value = {t.get("Key"): t.get("Value") for t in value}
+        out[path.replace(".", "")] = value
+    return out
+
+def fold_similar(records, identity_fields):
+    # Records that are equal once identity_fields are removed become one
+    # {"count", "ids", **shared fields} group; groups of one are kept as the original record.
+    # Groups keep first-seen order.
+    groups = {}
+    for record in records:
+        shared = {k: v for k, v in record.items() if k not in identity_fields}
+        key = minify(sorted(shared.items(), key=lambda kv: kv[0]))
+        group = groups.setdefault(key, {"first": record, "shared": shared, "count": 0, "ids": []})
+        group["count"] += 1
+        ident = next((record[f] for f in identity_fields if record.get(f) is not None), None)
+        if ident is not None and len(group["ids"]) < FOLD_SAMPLE_IDS:
+            group["ids"].append(ident)
+    return [
+        {"count": g["count"], "ids": g["ids"], **g["shared"]} if g["count"] > 1 else g["first"]
+        for g in groups.values()
+    ]
+
+def compact_records(records, fields=None, identity_fields=()):
+    # identity_fields are ordered: the first one present is what a folded group lists as its ids
+    projected = [project(r, fields) for r in records] if fields else list(records)
+    return fold_similar(projected, tuple(identity_fields)) if identity_fields else projected
+
+def chunk_records(records, max_tokens):
+    # Split records into chunks whose minified JSON stays under max_tokens (a single larger
+    # record still gets a chunk of its own)
+    chunks, current, used = [], [], 2
+    for record in records:
+        cost = estimate_tokens(minify(record)) + 1
+        if current and used + cost > max_tokens:
+            chunks.append(current)
+            current, used = [], 2
+        current.append(record)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+def map_reduce_summarize(records, build_prompt, ask, token_budget=PROMPT_TOKEN_BUDGET, max_workers=PROMPT_MAP_WORKERS, merge_instructions=None, final_ask=None):
+    # build_prompt(data_json, part) -> prompt, where part is None or "i/n" for chunked runs.
+    # ask(prompt) -> text. Returns one answer, merged from per-chunk answers when needed.
+    # final_ask, if given, makes the call that produces the answer (the single prompt or the
+    # last merge) and its result is returned as is, e.g. a generator of streamed chunks.
+    whole = build_prompt(minify(records), None)
+    if estimate_tokens(whole) <= token_budget:
+        return (final_ask or ask)(whole)
+
+    overhead = estimate_tokens(build_prompt("[]", "1/1"))
+    chunks = chunk_records(records, max(200, token_budget - overhead))
+    prompts = [build_prompt(minify(chunk), f"{i + 1}/{len(chunks)}") for i, chunk in enumerate(chunks)]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as pool:
+        partials = list(pool.map(ask, prompts))
+    return merge_summaries(partials, ask, token_budget, merge_instructions, final_ask)
+
+def merge_summaries(partials, ask, token_budget=PROMPT_TOKEN_BUDGET, merge_instructions=None, final_ask=None):
+    instructions = merge_instructions or (
+        "Merge these partial analyses of different slices of the same AWS environment into one answer. "
+        "Remove duplicates, keep every distinct finding, and keep the format of the partial answers."
+    )
+    prompt = instructions + "\n\n" + "\n\n".join(f"--- Part {i + 1} ---\n{p}" for i, p in enumerate(partials))
+    if estimate_tokens(prompt) <= token_budget or len(partials) <= 2:
+        return (final_ask or ask)(prompt)
+    # Too many partials for one call: merge them pairwise first
+    half = len(partials) // 2
+    return merge_summaries(
+        [merge_summaries(partials[:half], ask, token_budget, instructions),
+         merge_summaries(partials[half:], ask, token_budget, instructions)],
+        ask, token_budget, instructions, final_ask
+    )
@@ -0,0 +1,204 @@
+# File: ai/response_cache.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+# Prompt-keyed cache for Sonar responses.
+#
+# Entries are keyed by sha256(model, system prompt, user prompt) and expire after
+# SONAR_CACHE_TTL_SECONDS. The backend is S3 when SONAR_CACHE_BUCKET is set (boto3 is then
+# required), otherwise a local directory (SONAR_CACHE_DIR, default .sonar_cache/ at the repo
+# root). Once the cache grows past SONAR_CACHE_MAX_MB, the least recently used entries
+# are evicted. SONAR_CACHE_DISABLED=1 turns it off.
+
+SONAR_CACHE_DIR = os.getenv("SONAR_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".sonar_cache"))
+SONAR_CACHE_BUCKET = os.getenv("SONAR_CACHE_BUCKET", "")
+SONAR_CACHE_PREFIX = os.getenv("SONAR_CACHE_PREFIX", "sonar_cache/")
+SONAR_CACHE_TTL_SECONDS = int(os.getenv("SONAR_CACHE_TTL_SECONDS", "86400"))
+SONAR_CACHE_MAX_MB = float(os.getenv("SONAR_CACHE_MAX_MB", "50"))
+SONAR_CACHE_DISABLED = os.getenv("SONAR_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+# The S3 backend tracks its size between listings; it re-lists at least this often to pick up
+# entries written by other processes
+SONAR_CACHE_S3_RESYNC_SECONDS = int(os.getenv("SONAR_CACHE_S3_RESYNC_SECONDS", "3600"))
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+def get_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def cache_key(model, system_prompt, prompt):
+    raw = json.dumps([model, system_prompt, prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class DiskResponseCache:
+    def __init__(self, root=SONAR_CACHE_DIR, ttl_seconds=SONAR_CACHE_TTL_SECONDS, max_bytes=int(SONAR_CACHE_MAX_MB * 1024 * 1024)):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        path = self.root / f"{key}.json"
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created_at"] >= self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        # The file's mtime doubles as its last-used time for eviction
+        os.utime(path)
+        return entry["response"]
+
+    def put(self, key, model, response):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{key}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"created_at": time.time(), "model": model, "response": response}))
+        tmp.replace(path)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(self.root) if e.name.endswith(".json")]
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                Path(entry_path).unlink(missing_ok=True)
+                total -= size
+                _count("evictions")
+
+class S3ResponseCache:
+    def __init__(self, bucket=SONAR_CACHE_BUCKET, prefix=SONAR_CACHE_PREFIX, ttl_seconds=SONAR_CACHE_TTL_SECONDS, max_bytes=int(SONAR_CACHE_MAX_MB * 1024 * 1024)):
+        import boto3  # only needed for the S3 backend
+        self.s3 = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # Approximate prefix size: the last listing plus bytes written since (None until listed)
+        self.approx_bytes = None
+        self.listed_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+            entry = json.loads(obj["Body"].read())
+        except Exception:
+            return None
+        if time.time() - entry["created_at"] >= self.ttl_seconds:
+            return None
+        return entry["response"]
+
+    def put(self, key, model, response):
+        body = json.dumps({"created_at": time.time(), "model": model, "response": response}).encode("utf-8")
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json",
+            Body=body,
+            ContentType="application/json"
+        )
+        # Listing the prefix costs more as the cache grows, so it only happens once the tracked
+        # size passes the limit or the last listing is too old
+        with self.lock:
+            if self.approx_bytes is not None:
+                self.approx_bytes += len(body)
+            due = (
+                self.approx_bytes is None
+                or self.approx_bytes > self.max_bytes
+                or time.monotonic() - self.listed_at >= SONAR_CACHE_S3_RESYNC_SECONDS
+            )
+        if due:
+            self.evict()
+
+    def evict(self):
+        # S3 has no access time, so the oldest writes go first. Eviction goes down to 90% of
+        # the limit so the next few puts do not trigger another listing.
+        entries = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            entries.extend((obj["LastModified"], obj["Size"], obj["Key"]) for obj in page.get("Contents", []))
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * 0.9)
+        for _, size, key in sorted(entries):
+            if total <= target:
+                break
+            self.s3.delete_object(Bucket=self.bucket, Key=key)
+            total -= size
+            _count("evictions")
+        with self.lock:
+            self.approx_bytes = total
+            self.listed_at = time.monotonic()
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = S3ResponseCache() if SONAR_CACHE_BUCKET else DiskResponseCache()
+    return _backend
+
+def _read(key):
+    try:
+        return get_backend().get(key)
+    except Exception as e:
+        print(f"[Sonar cache read failed] {e}")
+        return None
+
+def _store(key, model, response):
+    try:
+        get_backend().put(key, model, response)
+        _count("stores")
+    except Exception as e:
+        print(f"[Sonar cache write failed] {e}")
+
+def cached_call(model, system_prompt, prompt, call, use_cache=True, cacheable=lambda response: True):
+    # Return the cached response for this exact request, or call() and store what it returns.
+    # Cache failures never fail the request; they just count as a miss.
+    if SONAR_CACHE_DISABLED or not use_cache:
+        _count("bypassed")
+        return call()
+    key = cache_key(model, system_prompt, prompt)
+    cached = _read(key)
+    if cached is not None:
+        _count("hits")
+        return cached
+    _count("misses")
+    response = call()
+    if cacheable(response):
+        _store(key, model, response)
+    return response
+
+def cached_stream(model, system_prompt, prompt, stream, use_cache=True, cacheable=lambda response: True):
+    # Streaming counterpart of cached_call: a cached response is yielded as a single chunk;
+    # otherwise the chunks of stream() are passed through and the joined text is stored once
+    # the stream completes.
+    if SONAR_CACHE_DISABLED or not use_cache:
+        _count("bypassed")
+        yield from stream()
+        return
+    key = cache_key(model, system_prompt, prompt)
+    cached = _read(key)
+    if cached is not None:
+        _count("hits")
+        yield cached
+        return
+    _count("misses")
+    chunks = []
+    for chunk in stream():
+        chunks.append(chunk)
+        yield chunk
+    response = "".join(chunks)
+    if cacheable(response):
+        _store(key, model, response)
@@ -3,24 +3,39 @@
 import os
 import requests
 from dotenv import load_dotenv
+from ai.response_cache import cached_call, cached_stream
+from ai.sonar_transport import post_chat, stream_chat
 
 load_dotenv()  # Loads .env from project root
 
 SONAR_API_KEY = os.getenv("SONAR_API_KEY")
-SONAR_ENDPOINT = "https://api.perplexity.ai/chat/completions"
 SONAR_MODEL = "sonar-pro"
 
-def ask_sonar(prompt, system_prompt="You are a concise, trusted cloud governance assistant."):
+def ask_sonar(prompt, system_prompt="You are a concise, trusted cloud governance assistant.", use_cache=True):
+    # Identical (model, system prompt, prompt) requests are answered from the response cache;
+    # use_cache=False always calls the API. Errors are never cached.
+    return cached_call(
+        SONAR_MODEL, system_prompt, prompt,
+        lambda: _request_sonar(prompt, system_prompt),
+        use_cache=use_cache,
+        cacheable=lambda response: not response.startswith("[Sonar API Error]"),
+    )
+
+def stream_sonar(prompt, system_prompt="You are a concise, trusted cloud governance assistant.", use_cache=True):
+    # Generator version of ask_sonar: yields text chunks as the API streams them.
+    # Responses that hit an error part-way are not cached.
+    return cached_stream(
+        SONAR_MODEL, system_prompt, prompt,
+        lambda: _stream_sonar(prompt, system_prompt),
+        use_cache=use_cache,
+        cacheable=lambda response: "[Sonar API Error]" not in response,
+    )
+
+def _sonar_payload(prompt, system_prompt):
     if not SONAR_API_KEY:
         raise EnvironmentError("Missing SONAR_API_KEY in environment variables")
 
-    headers = {
-        "Authorization": f"Bearer {SONAR_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-    payload = {
+    return {
         "model": SONAR_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
@@ -28,9 +43,21 @@ def ask_sonar(prompt, system_prompt="You are a concise, trusted cloud governance
         ]
     }
 
+def _request_sonar(prompt, system_prompt):
+    payload = _sonar_payload(prompt, system_prompt)
     try:
-        res = requests.post(SONAR_ENDPOINT, headers=headers, json=payload, timeout=30)
-        res.raise_for_status()
-        return res.json()["choices"][0]["message"]["content"]
+        return post_chat(payload, SONAR_API_KEY, timeout=30)["choices"][0]["message"]["content"]
     except requests.exceptions.RequestException as e:
         return f"[Sonar API Error] {str(e)}"
+
+def _stream_sonar(prompt, system_prompt):
+    payload = _sonar_payload(prompt, system_prompt)
+    started = False
+    try:
+        for chunk in stream_chat(payload, SONAR_API_KEY, timeout=30):
+            started = True
+            yield chunk
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # Network failures and malformed events (bad UTF-8 or JSON) alike: keep any text
+        # already shown and append the error after it
+        yield ("\n\n" if started else "") + f"[Sonar API Error] {str(e)}"
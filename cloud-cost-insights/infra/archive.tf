@@ -12,6 +12,6 @@ data "archive_file" "lambda_zip_prewarm" {
 
 data "archive_file" "lambda_zip_orphaned" {
   type        = "zip"
-  source_file = "${path.module}/lambda/orphaned_resources.py"
+  source_dir  = "${path.module}/lambda"
   output_path = "${path.module}/lambda_orphaned.zip"
 }
@@ -30,10 +30,12 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "logs:CreateLogGroup",
           "logs:CreateLogStream",
           "logs:PutLogEvents",
+          "ec2:DescribeRegions",
           "ec2:DescribeVolumes",
           "ec2:DescribeAddresses",
           "ec2:DescribeNetworkInterfaces",
-          "ec2:DescribeSecurityGroups"
+          "ec2:DescribeSecurityGroups",
+          "ec2:GetManagedPrefixListEntries"
         ],
         Resource = "*"
       },
@@ -44,6 +46,8 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action = [
           "s3:ListAllMyBuckets",
           "s3:GetBucketAcl",
+          "s3:GetBucketPolicyStatus",
+          "s3:GetBucketPublicAccessBlock",
           "s3:ListBucket"
         ],
         Resource = "*"
@@ -57,13 +61,23 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Resource = "arn:aws:s3:::${aws_s3_bucket.cost_cache.bucket}/*"
       },
 
+      # Async self-invoke for stale-while-revalidate refreshes of the cost cache
+      {
+        Effect = "Allow",
+        Action = [
+          "lambda:InvokeFunction"
+        ],
+        Resource = "arn:aws:lambda:${var.region}:*:function:${var.project_name}"
+      },
+
       # IAM introspection for risky users
       {
         Effect = "Allow",
         Action = [
-          "iam:ListUsers",
-          "iam:ListAttachedUserPolicies",
-          "iam:ListMFADevices"
+          "iam:GetAccountAuthorizationDetails",
+          "iam:GenerateCredentialReport",
+          "iam:GetCredentialReport",
+          "iam:ListVirtualMFADevices"
         ],
         Resource = "*"
       }
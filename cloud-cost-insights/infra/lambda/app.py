@@ -1,36 +1,319 @@
-import boto3
 import os
 import json
-from datetime import datetime, timedelta, timezone
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from cost_cache import (
+    daterange, cache_key_for, month_bounds, months_between, is_month_closed,
+    month_rollup_key, year_rollup_key, contiguous_runs, fetch_cost_range, list_day_objects, list_rollups, plan_rollup_reads,
+    to_columnar, decode_cache_body, put_cache_body, write_rollup, DayCache,
+)
+from cost_aggregation import parse_aggregation, aggregate_rows
+from cost_paging import query_fingerprint, decode_cursor, parse_page_size, paginate, to_ndjson
+from cost_metrics import RequestMetrics
+from aws_clients import get_client, client_stats
 
-ce = boto3.client("ce")
-s3 = boto3.client("s3")
+ce = get_client("ce")
+s3 = get_client("s3")
 
 CACHE_BUCKET = os.environ.get("CACHE_BUCKET_NAME")
 CACHE_TTL = int(os.environ.get("CACHE_TTL_MINUTES", "30"))
+CACHE_DOWNLOAD_WORKERS = int(os.environ.get("CACHE_DOWNLOAD_WORKERS", "8"))
+MEMORY_CACHE_MAX_MB = float(os.environ.get("MEMORY_CACHE_MAX_MB", "32"))
+# Days loaded for the first window of a paged request; later windows are sized from row density
+PAGE_WINDOW_DAYS = int(os.environ.get("PAGE_WINDOW_DAYS", "7"))
 
-def includes_today(start_str, end_str):
-    today = datetime.utcnow().date()
-    start_date = datetime.fromisoformat(start_str).date()
-    end_date = datetime.fromisoformat(end_str).date()
-    return start_date <= today <= end_date
+# Warm-container tier in front of S3; 0 disables it
+memory_cache = DayCache(int(MEMORY_CACHE_MAX_MB * 1024 * 1024), CACHE_TTL)
 
-def daterange(start_date, end_date):
-    for n in range((end_date - start_date).days + 1):
-        yield start_date + timedelta(n)
+# Stale-while-revalidate: an expired day object is still served (flagged as stale) while a
+# background refresh runs, as long as it is not older than the bound for that day.
+# Today's costs are still moving, so by default they are never served stale.
+SWR_MAX_STALENESS_HOURS = float(os.environ.get("SWR_MAX_STALENESS_HOURS", "168"))
+SWR_PREVIOUS_DAY_MAX_STALENESS_MINUTES = float(os.environ.get("SWR_PREVIOUS_DAY_MAX_STALENESS_MINUTES", "180"))
+SWR_CURRENT_DAY_MAX_STALENESS_MINUTES = float(os.environ.get("SWR_CURRENT_DAY_MAX_STALENESS_MINUTES", "0"))
+# "invoke": async self-invoke of this function; "local": in-process queue and worker thread; "off"
+SWR_REFRESH_MODE = os.environ.get("SWR_REFRESH_MODE", "invoke" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "local")
+# Do not queue the same day again while a refresh for it is probably still in flight
+SWR_REQUEUE_SECONDS = 300
 
-def cache_key_for(day, granularity):
-    # We continue to key the cache solely by day, granularity, and a literal __ALL__
-    # (i.e. this cache file contains the full day's cost data, not partitioned by service)
-    return f"cost_cache/{granularity}/__ALL__/{day.isoformat()}.json"
+refresh_queue = queue.Queue()
+refresh_worker = None
+refresh_requested = {}
 
 def is_cache_valid(obj):
+    # Accepts either a get_object response or a list_objects_v2 entry; both carry LastModified
     last_modified = obj["LastModified"]
     now = datetime.now(timezone.utc)
     age_minutes = (now - last_modified).total_seconds() / 60
     return age_minutes < CACHE_TTL
 
+def probe_cache(granularity, start_date, end_date, stats=None):
+    # Find the valid day keys in [start_date, end_date] from a listing instead of a GET per day
+    valid, expired = {}, {}
+    for day_str, obj in list_day_objects(s3, CACHE_BUCKET, granularity, start_date, end_date, stats).items():
+        if is_cache_valid(obj):
+            valid[day_str] = obj
+        else:
+            expired[day_str] = obj
+    return valid, expired
+
+def read_cached_object(key):
+    try:
+        return s3.get_object(Bucket=CACHE_BUCKET, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        # Deleted between the listing and the download; treat as a miss
+        return None
+
+def download_cached_objects(keys):
+    if not keys:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(CACHE_DOWNLOAD_WORKERS, len(keys)))) as pool:
+        return dict(zip(keys, pool.map(read_cached_object, keys)))
+
+def decode_cached_body(key, body, day_str=None):
+    if body is None:
+        return None
+    try:
+        return decode_cache_body(body, day_str)
+    except Exception as e:
+        # Unreadable or from a newer schema; treat as a miss and let the fresh data overwrite it
+        print(f"Failed to decode cache object {key}: {e}")
+        return None
+
+def write_back_rollups(granularity, start_date, end_date, rows_by_day, settled_days, month_rollups, year_rollups, today, stats=None):
+    # Compact closed months (and then closed years) fully inside the request once every one
+    # of their days is known to be final, so later long-range reads hit one object per month.
+    rolled_up = set(month_rollups)
+    for year, month in months_between(start_date, end_date):
+        first, last = month_bounds(year, month)
+        if (year, month) in rolled_up or not is_month_closed(year, month, today) or first < start_date or last > end_date:
+            continue
+        month_days = [d.isoformat() for d in daterange(first, last)]
+        if not all(d in settled_days for d in month_days):
+            continue
+        try:
+            write_rollup(s3, CACHE_BUCKET, month_rollup_key(year, month, granularity), {d: rows_by_day[d] for d in month_days}, stats)
+            rolled_up.add((year, month))
+        except Exception as e:
+            print(f"Failed to write rollup for {year}-{month:02d}: {e}")
+
+    for year in sorted({y for y, _ in months_between(start_date, end_date)}):
+        first, last = date(year, 1, 1), date(year, 12, 31)
+        if year in year_rollups or first < start_date or last > end_date:
+            continue
+        if not all((year, m) in rolled_up for m in range(1, 13)):
+            continue
+        if not all(d.isoformat() in settled_days for d in daterange(first, last)):
+            continue
+        try:
+            write_rollup(s3, CACHE_BUCKET, year_rollup_key(year, granularity), {d.isoformat(): rows_by_day[d.isoformat()] for d in daterange(first, last)}, stats)
+        except Exception as e:
+            print(f"Failed to write rollup for {year}: {e}")
+
+def max_staleness_minutes(day, today):
+    if day == today:
+        return SWR_CURRENT_DAY_MAX_STALENESS_MINUTES
+    if day == today - timedelta(days=1):
+        return SWR_PREVIOUS_DAY_MAX_STALENESS_MINUTES
+    return SWR_MAX_STALENESS_HOURS * 60
+
+def store_fresh_day(granularity, day, daily_results, today, now, stats=None):
+    # Write freshly fetched rows to both cache tiers; returns whether the day is settled (rollup-safe)
+    settled = is_month_closed(day.year, day.month, today)
+    memory_cache.put(granularity, day.isoformat(), daily_results, now, settled)
+    if CACHE_BUCKET:
+        try:
+            put_cache_body(s3, CACHE_BUCKET, cache_key_for(day, granularity), {day.isoformat(): daily_results}, stats)
+            print(f"Cached: {cache_key_for(day, granularity)}")
+        except Exception as e:
+            print(f"Failed to cache: {e}")
+    return settled
+
+def refresh_days(granularity, day_strs):
+    # Re-fetch the given days from CE and overwrite their cache entries
+    today = datetime.utcnow().date()
+    now = datetime.now(timezone.utc)
+    days = sorted(date.fromisoformat(d) for d in day_strs)
+    for run_start, run_end in contiguous_runs(days):
+        try:
+            fetched = fetch_cost_range(ce, run_start, run_end)
+        except Exception as e:
+            print(f"Revalidation failed for {run_start.isoformat()}..{run_end.isoformat()}: {e}")
+            continue
+        for day in daterange(run_start, run_end):
+            store_fresh_day(granularity, day, fetched.get(day.isoformat(), []), today, now)
+    for day_str in day_strs:
+        refresh_requested.pop((granularity, day_str), None)
+
+def run_refresh_worker():
+    while True:
+        granularity, day_strs = refresh_queue.get()
+        try:
+            refresh_days(granularity, day_strs)
+        finally:
+            refresh_queue.task_done()
+
+def queue_revalidation(granularity, day_strs):
+    # Returns how the refresh was scheduled, or None if nothing new needed scheduling
+    global refresh_worker
+    now = time.time()
+    day_strs = [d for d in day_strs if now - refresh_requested.get((granularity, d), 0) > SWR_REQUEUE_SECONDS]
+    if not day_strs or SWR_REFRESH_MODE == "off":
+        return None
+    for day_str in day_strs:
+        refresh_requested[(granularity, day_str)] = now
+    if SWR_REFRESH_MODE == "invoke":
+        try:
+            get_client("lambda").invoke(
+                FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+                InvocationType="Event",
+                Payload=json.dumps({"revalidate": {"granularity": granularity, "days": day_strs}})
+            )
+            return "invoke"
+        except Exception as e:
+            print(f"Async revalidation invoke failed, falling back to local queue: {e}")
+    # Local stand-in: a daemon worker in this container. Under Lambda it only makes
+    # progress while an invocation is running, so it is a fallback rather than the default.
+    if refresh_worker is None or not refresh_worker.is_alive():
+        refresh_worker = threading.Thread(target=run_refresh_worker, daemon=True)
+        refresh_worker.start()
+    refresh_queue.put((granularity, day_strs))
+    return "local"
+
+class DayLoad:
+    # Rows and cache accounting for the days a request has loaded so far
+    def __init__(self):
+        # Unfiltered rows per day; the service filter is applied when the response is assembled
+        self.rows_by_day = {}
+        # Days whose rows were fetched or cached after their month closed, i.e. safe to roll up
+        self.settled_days = set()
+        self.month_rollups, self.year_rollups = {}, {}
+        self.rollups_listed = False
+        self.memory_hits = 0
+        self.s3_hits = 0
+        self.cache_misses = 0
+        self.rollup_hits = 0
+        self.stale_days = []
+        self.revalidation = None
+
+def load_days(load, granularity, first, last, ignore_cache, today, now, metrics):
+    # Fill load with [first, last] from the memory tier, then S3 (rollups and day objects),
+    # then Cost Explorer for whatever is still missing
+    stats = metrics.counters
+    # Today's data is still changing, so it is always fetched fresh
+    include_today = first <= today <= last
+    cacheable_days = [d for d in daterange(first, last) if not (include_today and d == today)]
+
+    if not ignore_cache:
+        with metrics.phase("memory_lookup"):
+            for day in cacheable_days:
+                hit = memory_cache.get(granularity, day.isoformat(), now)
+                if hit is not None:
+                    load.rows_by_day[day.isoformat()], settled = hit
+                    if settled:
+                        load.settled_days.add(day.isoformat())
+                    load.memory_hits += 1
+
+    pending_days = [d for d in cacheable_days if d.isoformat() not in load.rows_by_day]
+    if CACHE_BUCKET and not ignore_cache and pending_days:
+        with metrics.phase("s3_probe"):
+            pending = {d.isoformat() for d in pending_days}
+            if not load.rollups_listed:
+                load.month_rollups, load.year_rollups = list_rollups(s3, CACHE_BUCKET, granularity, stats)
+                load.rollups_listed = True
+            rollup_keys, covered_months = plan_rollup_reads(pending_days[0], pending_days[-1], load.month_rollups, load.year_rollups)
+            remaining_days = [d for d in pending_days if (d.year, d.month) not in covered_months]
+            if include_today and SWR_CURRENT_DAY_MAX_STALENESS_MINUTES > 0:
+                remaining_days.append(today)
+            valid_days, expired_days = {}, {}
+            if remaining_days:
+                valid_days, expired_days = probe_cache(granularity, min(remaining_days), max(remaining_days), stats)
+                remaining = {d.isoformat() for d in remaining_days}
+                valid_days = {d: obj for d, obj in valid_days.items() if d in remaining}
+                expired_days = {d: obj for d, obj in expired_days.items() if d in remaining}
+                # Today is never a fresh hit; at best it is served stale
+                if today.isoformat() in valid_days:
+                    expired_days[today.isoformat()] = valid_days.pop(today.isoformat())
+            stale_candidates = {
+                d: obj for d, obj in expired_days.items()
+                if (now - obj["LastModified"]).total_seconds() / 60 <= max_staleness_minutes(date.fromisoformat(d), today)
+            }
+
+        with metrics.phase("s3_download"):
+            keys = rollup_keys + [obj["Key"] for obj in valid_days.values()] + [obj["Key"] for obj in stale_candidates.values()]
+            bodies = download_cached_objects(keys)
+            metrics.count("s3_get_requests", len(keys))
+            metrics.count("s3_bytes_read", sum(len(b) for b in bodies.values() if b is not None))
+
+        with metrics.phase("decode"):
+            for key in rollup_keys:
+                decoded = decode_cached_body(key, bodies.get(key))
+                if decoded is not None:
+                    load.rollup_hits += 1
+                    for day_str, rows in decoded.items():
+                        # Rollups are immutable, so the memory tier may keep them past the TTL
+                        memory_cache.put(granularity, day_str, rows, None, True)
+                        if day_str in pending:
+                            load.rows_by_day[day_str] = rows
+                            load.settled_days.add(day_str)
+                            load.s3_hits += 1
+            for day_str, obj in valid_days.items():
+                decoded = decode_cached_body(obj["Key"], bodies.get(obj["Key"]), day_str)
+                if decoded is not None and day_str in decoded:
+                    load.rows_by_day[day_str] = decoded[day_str]
+                    day = date.fromisoformat(day_str)
+                    settled = is_month_closed(day.year, day.month, obj["LastModified"].date())
+                    if settled:
+                        load.settled_days.add(day_str)
+                    memory_cache.put(granularity, day_str, decoded[day_str], obj["LastModified"], settled)
+                    load.s3_hits += 1
+            for day_str, obj in stale_candidates.items():
+                decoded = decode_cached_body(obj["Key"], bodies.get(obj["Key"]), day_str)
+                if decoded is not None and day_str in decoded:
+                    load.rows_by_day[day_str] = decoded[day_str]
+                    load.stale_days.append(day_str)
+                    load.s3_hits += 1
+        window_stale = [d for d in load.stale_days if first.isoformat() <= d <= last.isoformat()]
+        if window_stale:
+            load.revalidation = queue_revalidation(granularity, window_stale) or load.revalidation
+
+    uncached_days = [d for d in daterange(first, last) if d.isoformat() not in load.rows_by_day]
+    load.cache_misses += len(uncached_days)
+
+    # Fetch uncached days one contiguous run at a time instead of one CE call per day.
+    # The full day is always fetched (and cached under __ALL__).
+    for run_start, run_end in contiguous_runs(uncached_days):
+        try:
+            with metrics.phase("ce_fetch"):
+                fetched = fetch_cost_range(ce, run_start, run_end, stats)
+        except Exception as e:
+            print(f"Error fetching data for {run_start.isoformat()}..{run_end.isoformat()}: {e}")
+            continue
+        with metrics.phase("cache_write"):
+            for day in daterange(run_start, run_end):
+                daily_results = fetched.get(day.isoformat(), [])
+                load.rows_by_day[day.isoformat()] = daily_results
+                if store_fresh_day(granularity, day, daily_results, today, now, stats):
+                    load.settled_days.add(day.isoformat())
+
+    # Without a listing (ignore_cache, or everything served from memory) we cannot tell
+    # which immutable rollups already exist
+    if CACHE_BUCKET and load.rollups_listed:
+        with metrics.phase("rollup_write"):
+            write_back_rollups(granularity, first, last, load.rows_by_day, load.settled_days, load.month_rollups, load.year_rollups, today, stats)
+
 def lambda_handler(event, context):
+    if "revalidate" in event:
+        # Async self-invoke queued by a stale read
+        job = event["revalidate"]
+        print(f"Revalidating {len(job['days'])} {job['granularity']} day(s)")
+        refresh_days(job["granularity"], job["days"])
+        return {"statusCode": 200, "body": json.dumps({"message": "Revalidated", "days": job["days"]})}
+
     print("Received event:", json.dumps(event))
     try:
         body = json.loads(event.get("body", "{}"))
@@ -45,6 +328,20 @@ def lambda_handler(event, context):
     start_str = body.get("start") or (datetime.utcnow() - timedelta(days=default_lookback_days)).date().isoformat()
     granularity = body.get("granularity", "DAILY")
     ignore_cache = body.get("ignore_cache", False)
+    # "rows" (default): [{"date", "service", "cost": "$12.34"}]; "columnar": the numeric cache layout;
+    # "ndjson": one numeric row per line between a meta header and an end line with the next cursor
+    response_format = body.get("format", "rows")
+    if response_format not in ("rows", "columnar", "ndjson"):
+        return {"statusCode": 400, "body": json.dumps({"error": f"Unsupported format: {response_format}"})}
+    # Optional server-side aggregation; the response then carries only the aggregated rows
+    aggregation = None
+    if body.get("aggregate") is not None:
+        try:
+            aggregation = parse_aggregation(body["aggregate"])
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+        if response_format == "ndjson" or body.get("page_size") is not None or body.get("cursor"):
+            return {"statusCode": 400, "body": json.dumps({"error": "aggregate cannot be combined with pagination or ndjson"})}
 
     # Accept service filter as a string or list; we do not change the cache key.
     raw_services = body.get("service")
@@ -56,94 +353,137 @@ def lambda_handler(event, context):
 
     start_date = datetime.fromisoformat(start_str).date()
     end_date = datetime.fromisoformat(end_str).date()
-    include_today = includes_today(start_str, end_str)
-
-    results = []
-    uncached_days = []
-    all_cached = True
-    cache_hits = 0
-    cache_misses = 0
-
-    # Loop over each day in the date range
-    for day in daterange(start_date, end_date):
-        key = cache_key_for(day, granularity)
-        should_check_cache = CACHE_BUCKET and not ignore_cache and not (include_today and day == datetime.utcnow().date())
-        if should_check_cache:
-            try:
-                obj = s3.get_object(Bucket=CACHE_BUCKET, Key=key)
-                if is_cache_valid(obj):
-                    cached = json.loads(obj["Body"].read())
-                    # When filtering, do it in-memory on the cached daily data.
-                    filtered = [entry for entry in cached if not service_list or entry["service"] in service_list]
-                    results.extend(filtered)
-                    cache_hits += 1
-                    print(f"Loaded from cache: {key}")
-                    continue
-                else:
-                    print(f"Expired cache: {key}")
-            except s3.exceptions.NoSuchKey:
-                print(f"No cache: {key}")
-        cache_misses += 1
-        all_cached = False
-        uncached_days.append(day)
-
-    # For all days that weren’t served from cache, fetch fresh data
-    for day in uncached_days:
-        day_str = day.isoformat()
-        try:
-            # Build filter: note that if service_list is empty, no filter is applied.
-            filter_block = None
-            if service_list:
-                # Allow multiple values:
-                filter_block = {
-                    "Dimensions": {
-                        "Key": "SERVICE",
-                        "Values": service_list if isinstance(service_list, list) else [service_list]
-                    }
-                }
-            response = ce.get_cost_and_usage(
-                TimePeriod={"Start": day_str, "End": (day + timedelta(days=1)).isoformat()},
-                Granularity=granularity,
-                Metrics=["UnblendedCost"],
-                GroupBy=[{"Type": "DIMENSION", "Key": "SERVICE"}],
-                **({"Filter": filter_block} if filter_block else {})
-            )
-            daily_results = []
-            for group in response["ResultsByTime"][0].get("Groups", []):
-                service = group["Keys"][0]
-                cost = group["Metrics"]["UnblendedCost"]["Amount"]
-                daily_results.append({
-                    "date": day_str,
-                    "service": service,
-                    "cost": f"${float(cost):.2f}"
-                })
-            results.extend(daily_results)
-            if CACHE_BUCKET:
-                try:
-                    s3.put_object(
-                        Bucket=CACHE_BUCKET,
-                        Key=cache_key_for(day, granularity),
-                        Body=json.dumps(daily_results),
-                        ContentType="application/json"
-                    )
-                    print(f"Cached: {cache_key_for(day, granularity)}")
-                except Exception as e:
-                    print(f"Failed to cache: {e}")
-        except Exception as e:
-            print(f"Error fetching data for {day_str}: {e}")
 
-    source = "cache" if all_cached else ("fresh" if cache_hits == 0 else "mixed")
+    # Pagination: rows are ordered by (date, service); a cursor resumes after the last row
+    # returned, so the days before it are not loaded again.
+    fingerprint = query_fingerprint(start_str, end_str, granularity, service_list)
+    after = None
+    try:
+        page_size = parse_page_size(body.get("page_size"))
+        if body.get("cursor"):
+            after = decode_cursor(body["cursor"], fingerprint)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    if after is not None:
+        start_date = max(start_date, date.fromisoformat(after[0]))
+
+    metrics = RequestMetrics()
+    today = datetime.utcnow().date()
+    now = datetime.now(timezone.utc)
+    load = DayLoad()
+
+    # Unpaged requests load the whole range. A page only needs page_size rows after the
+    # cursor, so days are loaded in windows until that many rows (plus one, to know whether
+    # another page follows) are available or the range is exhausted. ignore_cache applies to
+    # every page: each page loads only its own window, so a paged refresh re-fetches at most
+    # the cursor day twice.
+    load_end = end_date if page_size is None else min(end_date, start_date + timedelta(days=PAGE_WINDOW_DAYS - 1))
+    load_days(load, granularity, start_date, load_end, ignore_cache, today, now, metrics)
+    while load_end < end_date:
+        available = sum(
+            1
+            for day in daterange(start_date, load_end)
+            for entry in load.rows_by_day.get(day.isoformat(), [])
+            if (not service_list or entry["service"] in service_list)
+            and (after is None or (entry["date"], entry["service"]) > after)
+        )
+        if available > page_size:
+            break
+        # Size the next window from the row density seen so far
+        loaded_days = (load_end - start_date).days + 1
+        needed = page_size + 1 - available
+        window_days = -(-needed * loaded_days // available) if available else loaded_days * 2
+        next_start = load_end + timedelta(days=1)
+        load_end = min(end_date, next_start + timedelta(days=window_days - 1))
+        load_days(load, granularity, next_start, load_end, ignore_cache, today, now, metrics)
+
+    with metrics.phase("assemble"):
+        # When filtering, do it in-memory on the full daily data.
+        ordered = [
+            entry
+            for day in daterange(start_date, load_end)
+            for entry in sorted(load.rows_by_day.get(day.isoformat(), []), key=lambda e: e["service"])
+            if not service_list or entry["service"] in service_list
+        ]
+        extra = {}
+        if aggregation is None:
+            ordered, next_cursor = paginate(ordered, page_size, after, fingerprint)
+            extra = {"page_size": page_size, "next_cursor": next_cursor}
+        if aggregation is not None:
+            group_by, top_n = aggregation
+            aggregated = aggregate_rows(ordered, group_by, top_n)
+            results = [{**entry, "cost": float(entry["cost"])} for entry in aggregated]
+            extra = {
+                "aggregate": {"group_by": group_by, "top_n": top_n},
+                "total": float(sum((entry["cost"] for entry in aggregated), Decimal(0))),
+            }
+        elif response_format == "columnar":
+            page_by_day = {}
+            for entry in ordered:
+                page_by_day.setdefault(entry["date"], []).append(entry)
+            results = to_columnar(page_by_day)
+            results["cost"] = [float(c) for c in results["cost"]]
+        elif response_format == "ndjson":
+            results = [{"date": entry["date"], "service": entry["service"], "cost": float(entry["cost"])} for entry in ordered]
+        else:
+            results = [
+                {"date": entry["date"], "service": entry["service"], "cost": f"${entry['cost']:.2f}"}
+                for entry in ordered
+            ]
+    cache_hits = load.memory_hits + load.s3_hits
+    if load.cache_misses:
+        source = "fresh" if cache_hits == 0 else "mixed"
+    else:
+        source = "memory" if load.s3_hits == 0 else "cache"
+    metrics.count("rows_returned", len(results["cost"]) if response_format == "columnar" and aggregation is None else len(results))
+    metrics.count("memory_hits", load.memory_hits)
+    metrics.count("s3_hits", load.s3_hits)
+    metrics.count("stale_hits", len(load.stale_days))
+    metrics.count("cache_misses", load.cache_misses)
+    meta = {
+        "message": "Cost data fetched",
+        "start": start_str,
+        "end": end_str,
+        "granularity": granularity,
+        "format": response_format,
+        "source": source,
+        "cache_hits": {"memory": load.memory_hits, "s3": load.s3_hits},
+        "cache_misses": load.cache_misses,
+        "rollup_hits": load.rollup_hits,
+        "stale": bool(load.stale_days),
+        "stale_days": load.stale_days,
+        "revalidation": load.revalidation,
+        "cache_probe_ms": metrics.phase_ms("s3_probe"),
+        "cache_download_ms": metrics.phase_ms("s3_download"),
+        "services_requested": service_list,
+        **extra
+    }
+
+    def serialize(meta):
+        if response_format == "ndjson":
+            return to_ndjson(meta, results, extra["next_cursor"])
+        return json.dumps({**meta, "results": results})
+
+    with metrics.phase("serialize"):
+        response_body = serialize(meta)
+    if body.get("debug_timing"):
+        # Opt-in; costs a second serialization so the block can include the first one's timing
+        response_body = serialize({**meta, "debug_timing": {**metrics.debug_block(), "aws_clients": client_stats()}})
+    # Client counters are per container (cumulative across warm invocations), so they are logged as properties
+    metrics.emit(source, {
+        "Granularity": granularity,
+        "Days": (load_end - start_date).days + 1,
+        "Format": response_format,
+        "AwsClients": client_stats(),
+    })
+
+    if response_format == "ndjson":
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/x-ndjson"},
+            "body": response_body
+        }
     return {
         "statusCode": 200,
-        "body": json.dumps({
-            "message": "Cost data fetched",
-            "start": start_str,
-            "end": end_str,
-            "granularity": granularity,
-            "results": results,
-            "source": source,
-            "cache_hits": cache_hits,
-            "cache_misses": cache_misses,
-            "services_requested": service_list
-        })
+        "body": response_body
     }
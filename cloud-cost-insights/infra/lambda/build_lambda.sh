@@ -11,18 +11,18 @@ python3 -m pip install -r requirements.txt -t build/
 
 # --- Build Security Guard ---
 echo "🔐 Building Security Guard Lambda..."
-cp security_guard.py build/
+cp security_guard.py aws_clients.py scan_cache.py deadline.py sonar_transport.py build/
 cd build
 zip -r ../lambda_security.zip .
-rm security_guard.py
+rm security_guard.py aws_clients.py scan_cache.py deadline.py sonar_transport.py
 cd ..
 
 # --- Build IaC Refactor ---
 echo "🛠️ Building IaC Refactor Lambda..."
-cp governance_copilot.py build/
+cp governance_copilot.py aws_clients.py deadline.py sonar_transport.py resource_collectors.py prompt_compaction.py build/
 cd build
 zip -r ../lambda_governance.zip .
-rm governance_copilot.py
+rm governance_copilot.py aws_clients.py deadline.py sonar_transport.py resource_collectors.py prompt_compaction.py
 cd ..
 
 echo "✅ All Lambda packages built successfully."
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+# Server-side aggregation for the cost-insights API.
+#
+# Request body:
+#   "aggregate": {"group_by": ["week", "service"], "top_n": 5}
+#
+# group_by holds "service" and/or one time bucket ("date", "week", "month"); an empty
+# list returns only the grand total. top_n keeps the N most expensive services over the
+# whole range and folds the rest into "Other".
+
+TIME_BUCKETS = {
+    "date": lambda day_str: day_str,
+    # ISO weeks, labelled by their Monday
+    "week": lambda day_str: (date.fromisoformat(day_str) - timedelta(days=date.fromisoformat(day_str).weekday())).isoformat(),
+    "month": lambda day_str: day_str[:7],
+}
+OTHER_SERVICE = "Other"
+
+def parse_aggregation(raw):
+    # Returns (group_by, top_n) or raises ValueError with a message for the 400 response
+    if not isinstance(raw, dict):
+        raise ValueError("aggregate must be an object")
+    group_by = raw.get("group_by", ["service"])
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    if not isinstance(group_by, list) or any(g not in TIME_BUCKETS and g != "service" for g in group_by):
+        raise ValueError(f"group_by must be a list of: service, {', '.join(TIME_BUCKETS)}")
+    if len([g for g in group_by if g in TIME_BUCKETS]) > 1:
+        raise ValueError("group_by accepts at most one of: " + ", ".join(TIME_BUCKETS))
+    top_n = raw.get("top_n")
+    if top_n is not None and (not isinstance(top_n, int) or isinstance(top_n, bool) or top_n < 1):
+        raise ValueError("top_n must be a positive integer")
+    return group_by, top_n
+
+def aggregate_rows(rows, group_by, top_n=None):
+    # rows: [{"date", "service", "cost": Decimal}] -> [{<group_by fields>..., "cost": Decimal}]
+    if not group_by:
+        return [{"cost": sum((entry["cost"] for entry in rows), Decimal(0))}]
+    if top_n is not None:
+        by_service = {}
+        for entry in rows:
+            by_service[entry["service"]] = by_service.get(entry["service"], Decimal(0)) + entry["cost"]
+        ranked = sorted(by_service, key=lambda svc: by_service[svc], reverse=True)
+        kept = set(ranked[:top_n])
+    time_field = next((g for g in group_by if g in TIME_BUCKETS), None)
+
+    totals = {}
+    for entry in rows:
+        service = entry["service"] if top_n is None or entry["service"] in kept else OTHER_SERVICE
+        key = []
+        for field in group_by:
+            key.append(service if field == "service" else TIME_BUCKETS[field](entry["date"]))
+        key = tuple(key)
+        totals[key] = totals.get(key, Decimal(0)) + entry["cost"]
+
+    # Time buckets ascending, then most expensive first
+    time_index = group_by.index(time_field) if time_field else None
+    ordered = sorted(
+        totals.items(),
+        key=lambda item: (item[0][time_index] if time_field else "", -item[1])
+    )
+    return [dict(zip(group_by, key), cost=cost) for key, cost in ordered]
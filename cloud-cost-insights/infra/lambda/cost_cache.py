@@ -0,0 +1,290 @@
+import os
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+
+# Shared S3 cost cache layout used by app.py (cost insights) and prewarm.py.
+#
+#   cost_cache/<granularity>/__ALL__/<YYYY-MM-DD>.json   one full day (TTL applies)
+#   cost_cache/<granularity>/__ALL__/monthly/<YYYY-MM>.json   closed month rollup (immutable)
+#   cost_cache/<granularity>/__ALL__/yearly/<YYYY>.json       closed year rollup (immutable)
+#
+# Rollups hold the same day-level rows as the daily objects, grouped by day.
+#
+# Object bodies (keys keep their .json suffix across versions):
+#   v0: plain JSON; a day is a list of {"date", "service", "cost": "$12.34"} rows and a
+#       rollup is {"days": {day: [rows]}}. Still readable, no longer written.
+#   v1: gzip-compressed, column-oriented JSON with dictionary-encoded dates and services
+#       and exact decimal amounts as strings:
+#       {"v": 1, "dates": [...], "services": [...], "date": [i], "service": [j], "cost": ["12.3456"]}
+#       Every day the object covers is listed in "dates", even days without rows.
+#
+# In memory, rows are {"date": str, "service": str, "cost": Decimal}.
+
+CACHE_SCHEMA_VERSION = 1
+
+# Days Cost Explorer may still revise a month after it ends; a month is only rolled up once this has passed
+ROLLUP_SETTLE_DAYS = int(os.environ.get("ROLLUP_SETTLE_DAYS", "3"))
+
+def bump(stats, name, value=1):
+    # Optional request counters (e.g. cost_metrics.RequestMetrics.counters); a no-op when stats is None
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+def daterange(start_date, end_date):
+    for n in range((end_date - start_date).days + 1):
+        yield start_date + timedelta(n)
+
+def cache_prefix_for(granularity):
+    return f"cost_cache/{granularity}/__ALL__/"
+
+def cache_key_for(day, granularity):
+    # We continue to key the cache solely by day, granularity, and a literal __ALL__
+    # (i.e. this cache file contains the full day's cost data, not partitioned by service)
+    return f"{cache_prefix_for(granularity)}{day.isoformat()}.json"
+
+def month_rollup_key(year, month, granularity):
+    return f"{cache_prefix_for(granularity)}monthly/{year:04d}-{month:02d}.json"
+
+def year_rollup_key(year, granularity):
+    return f"{cache_prefix_for(granularity)}yearly/{year:04d}.json"
+
+def month_bounds(year, month):
+    first = date(year, month, 1)
+    next_first = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return first, next_first - timedelta(days=1)
+
+def months_between(start_date, end_date):
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def is_month_closed(year, month, today):
+    return (today - month_bounds(year, month)[1]).days > ROLLUP_SETTLE_DAYS
+
+def is_year_closed(year, today):
+    return is_month_closed(year, 12, today)
+
+def contiguous_runs(days):
+    # Collapse a sorted list of days into (first, last) pairs of consecutive days
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+def fetch_cost_range(ce, start_date, end_date, stats=None):
+    # One paginated CE request for the whole run, split back into per-day rows.
+    # DAILY granularity is used regardless of the requested one: each cache object holds a single day.
+    # stats, if given, counts billed CE requests under "ce_requests".
+    rows_by_day = {}
+    kwargs = {
+        "TimePeriod": {"Start": start_date.isoformat(), "End": (end_date + timedelta(days=1)).isoformat()},
+        "Granularity": "DAILY",
+        "Metrics": ["UnblendedCost"],
+        "GroupBy": [{"Type": "DIMENSION", "Key": "SERVICE"}],
+    }
+    while True:
+        response = ce.get_cost_and_usage(**kwargs)
+        bump(stats, "ce_requests")
+        for period in response.get("ResultsByTime", []):
+            day_str = period["TimePeriod"]["Start"]
+            daily_results = rows_by_day.setdefault(day_str, [])
+            for group in period.get("Groups", []):
+                service = group["Keys"][0]
+                cost = group["Metrics"]["UnblendedCost"]["Amount"]
+                daily_results.append({
+                    "date": day_str,
+                    "service": service,
+                    "cost": Decimal(cost)
+                })
+        token = response.get("NextPageToken")
+        if not token:
+            return rows_by_day
+        kwargs["NextPageToken"] = token
+
+def list_day_objects(s3, bucket, granularity, start_date, end_date, stats=None):
+    # List the day keys in [start_date, end_date] in a few calls; returns {day: list_objects_v2 entry}.
+    # Keys sort lexicographically by ISO date, so StartAfter skips everything before the range
+    # and the rollup sub-prefixes (monthly/, yearly/) sort after every day key.
+    prefix = cache_prefix_for(granularity)
+    last_key = cache_key_for(end_date, granularity)
+    kwargs = {
+        "Bucket": bucket,
+        "Prefix": prefix,
+        "StartAfter": cache_key_for(start_date - timedelta(days=1), granularity),
+    }
+    found = {}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        bump(stats, "s3_list_requests")
+        for obj in response.get("Contents", []):
+            if obj["Key"] > last_key:
+                return found
+            found[obj["Key"][len(prefix):-len(".json")]] = obj
+        if not response.get("IsTruncated"):
+            return found
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+def list_rollups(s3, bucket, granularity, stats=None):
+    # Returns ({(year, month): key}, {year: key}) for every rollup object that exists
+    prefix = cache_prefix_for(granularity)
+    months, years = {}, {}
+    for kind, found in (("monthly", months), ("yearly", years)):
+        kwargs = {"Bucket": bucket, "Prefix": f"{prefix}{kind}/"}
+        while True:
+            response = s3.list_objects_v2(**kwargs)
+            bump(stats, "s3_list_requests")
+            for obj in response.get("Contents", []):
+                stem = obj["Key"][len(kwargs["Prefix"]):-len(".json")]
+                if kind == "monthly":
+                    found[(int(stem[:4]), int(stem[5:7]))] = obj["Key"]
+                else:
+                    found[int(stem)] = obj["Key"]
+            if not response.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+    return months, years
+
+def plan_rollup_reads(start_date, end_date, month_rollups, year_rollups):
+    # Pick the coarsest existing rollups covering [start_date, end_date].
+    # A yearly rollup is used when the range touches more than one month of that year.
+    # Returns (rollup keys to read, the (year, month) pairs they cover).
+    months = months_between(start_date, end_date)
+    keys, covered = [], set()
+    for year in sorted({y for y, _ in months}):
+        year_months = [(y, m) for y, m in months if y == year]
+        if year in year_rollups and len(year_months) > 1:
+            keys.append(year_rollups[year])
+            covered.update(year_months)
+            continue
+        for ym in year_months:
+            if ym in month_rollups:
+                keys.append(month_rollups[ym])
+                covered.add(ym)
+    return keys, covered
+
+def to_columnar(rows_by_day):
+    dates = sorted(rows_by_day)
+    services, service_index = [], {}
+    date_col, service_col, cost_col = [], [], []
+    for i, day_str in enumerate(dates):
+        for entry in rows_by_day[day_str]:
+            j = service_index.get(entry["service"])
+            if j is None:
+                j = service_index[entry["service"]] = len(services)
+                services.append(entry["service"])
+            date_col.append(i)
+            service_col.append(j)
+            cost_col.append(entry["cost"])
+    return {"dates": dates, "services": services, "date": date_col, "service": service_col, "cost": cost_col}
+
+def from_columnar(columns):
+    rows_by_day = {day_str: [] for day_str in columns["dates"]}
+    for i, j, cost in zip(columns["date"], columns["service"], columns["cost"]):
+        day_str = columns["dates"][i]
+        rows_by_day[day_str].append({"date": day_str, "service": columns["services"][j], "cost": Decimal(cost)})
+    return rows_by_day
+
+def parse_legacy_cost(cost):
+    return Decimal(str(cost).replace("$", "").replace(",", ""))
+
+def encode_cache_body(rows_by_day):
+    columns = to_columnar(rows_by_day)
+    columns["cost"] = [str(c) for c in columns["cost"]]
+    payload = {"v": CACHE_SCHEMA_VERSION, **columns}
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+def decode_cache_body(body, day_str=None):
+    # Returns {day: [rows]}. day_str is only needed for v0 daily objects, which do not
+    # record their own date when empty.
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    payload = json.loads(body)
+    if isinstance(payload, list):
+        return {day_str: [
+            {"date": e["date"], "service": e["service"], "cost": parse_legacy_cost(e["cost"])} for e in payload
+        ]}
+    if "v" not in payload:
+        return {
+            d: [{"date": e["date"], "service": e["service"], "cost": parse_legacy_cost(e["cost"])} for e in rows]
+            for d, rows in payload["days"].items()
+        }
+    if payload["v"] != CACHE_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported cost cache schema version: {payload['v']}")
+    return from_columnar(payload)
+
+def put_cache_body(s3, bucket, key, rows_by_day, stats=None):
+    bump(stats, "s3_put_requests")
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=encode_cache_body(rows_by_day),
+        ContentType="application/json",
+        ContentEncoding="gzip",
+        Metadata={"schema-version": str(CACHE_SCHEMA_VERSION)}
+    )
+
+def write_rollup(s3, bucket, key, rows_by_day, stats=None):
+    put_cache_body(s3, bucket, key, rows_by_day, stats)
+    print(f"Rolled up {len(rows_by_day)} days into {key}")
+
+def estimate_rows_bytes(rows):
+    # Rough in-memory footprint of a day's rows (dicts, strings and Decimals); only used for the memory cap
+    return 64 + sum(200 + len(entry["service"]) for entry in rows)
+
+class DayCache:
+    # Bounded in-process LRU of day rows keyed by (granularity, day). It lives at module level
+    # so it survives across warm invocations of the same container.
+    # Entries loaded from immutable rollups never expire; everything else honors the TTL
+    # relative to when the data was produced (S3 LastModified or fetch time).
+    # The local stale-while-revalidate worker writes from its own thread, so every access
+    # to entries holds the lock.
+
+    def __init__(self, max_bytes, ttl_minutes):
+        self.max_bytes = max_bytes
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, granularity, day_str, now):
+        # Returns (rows, settled) or None
+        key = (granularity, day_str)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            rows, produced_at, settled, size = entry
+            if produced_at is not None and now - produced_at >= self.ttl:
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return rows, settled
+
+    def put(self, granularity, day_str, rows, produced_at, settled):
+        if self.max_bytes <= 0:
+            return
+        key = (granularity, day_str)
+        size = estimate_rows_bytes(rows)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (rows, produced_at, settled, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        # Callers hold the lock
+        self.size -= self.entries.pop(key)[3]
@@ -0,0 +1,79 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Per-request instrumentation for the cost-insights Lambda, emitted as one CloudWatch
+# Embedded Metric Format (EMF) log line so CloudWatch extracts the metrics from the logs
+# without any PutMetricData calls.
+
+METRICS_NAMESPACE = "CloudCostInsights"
+
+COUNTER_UNITS = {
+    "s3_list_requests": "Count",
+    "s3_get_requests": "Count",
+    "s3_put_requests": "Count",
+    "s3_bytes_read": "Bytes",
+    "ce_requests": "Count",
+    "rows_returned": "Count",
+    "memory_hits": "Count",
+    "s3_hits": "Count",
+    "cache_misses": "Count",
+    "stale_hits": "Count",
+}
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        # Plain dict so it can be passed as the stats argument of the cost_cache helpers
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        # Phases may be entered several times per request; durations add up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def phase_ms(self, name):
+        return round(self.phases.get(name, 0.0))
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def debug_block(self):
+        return {
+            "total_ms": round(self.total_ms(), 1),
+            "phases_ms": {name: round(ms, 1) for name, ms in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+    def emit(self, cache_tier, properties=None):
+        metrics = [{"Name": "TotalMs", "Unit": "Milliseconds"}]
+        values = {"TotalMs": round(self.total_ms(), 1)}
+        for name, ms in self.phases.items():
+            metric = "".join(part.capitalize() for part in name.split("_")) + "Ms"
+            metrics.append({"Name": metric, "Unit": "Milliseconds"})
+            values[metric] = round(ms, 1)
+        for name, value in self.counters.items():
+            metric = "".join(part.capitalize() for part in name.split("_"))
+            metrics.append({"Name": metric, "Unit": COUNTER_UNITS.get(name, "Count")})
+            values[metric] = value
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["CacheTier"]],
+                    "Metrics": metrics,
+                }],
+            },
+            "CacheTier": cache_tier,
+            **values,
+            **(properties or {}),
+        }))
@@ -0,0 +1,54 @@
+import base64
+import hashlib
+import json
+
+# Cursor pagination for the cost-insights API.
+#
+# Rows are ordered by (date, service). A cursor is an opaque, URL-safe token holding the
+# last (date, service) returned plus a fingerprint of the query it belongs to, so a page
+# can be resumed without re-reading any day before the cursor date.
+
+MAX_PAGE_SIZE = 5000
+
+def query_fingerprint(start_str, end_str, granularity, service_list):
+    raw = json.dumps([start_str, end_str, granularity, sorted(service_list)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def encode_cursor(fingerprint, last_row):
+    raw = json.dumps({"q": fingerprint, "d": last_row["date"], "s": last_row["service"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, fingerprint):
+    # Returns the (date, service) to resume after, or raises ValueError
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        after = (payload["d"], payload["s"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if payload.get("q") != fingerprint:
+        raise ValueError("Cursor does not belong to this query")
+    return after
+
+def parse_page_size(raw):
+    if raw is None:
+        return None
+    if not isinstance(raw, int) or isinstance(raw, bool) or not 1 <= raw <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be an integer between 1 and {MAX_PAGE_SIZE}")
+    return raw
+
+def paginate(rows, page_size, after, fingerprint):
+    # rows must already be in (date, service) order; returns (page, next_cursor)
+    if after is not None:
+        rows = [entry for entry in rows if (entry["date"], entry["service"]) > after]
+    if page_size is None or len(rows) <= page_size:
+        return rows, None
+    page = rows[:page_size]
+    return page, encode_cursor(fingerprint, page[-1])
+
+def to_ndjson(meta, rows, next_cursor):
+    # One JSON document per line: a meta header, one line per row, then the resume token
+    lines = [json.dumps({"type": "meta", **meta})]
+    lines.extend(json.dumps({"type": "row", **entry}) for entry in rows)
+    lines.append(json.dumps({"type": "end", "next_cursor": next_cursor, "rows": len(rows)}))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,48 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Invocation deadlines for the scanning Lambdas.
+#
+# A Deadline tracks context.get_remaining_time_in_millis() minus a safety reserve for
+# serializing and returning the response. Stages get a time budget out of what is left, and
+# whatever they produced by then is returned with the names of the stages that did not finish.
+# Without a Lambda context (local runs) DEADLINE_DEFAULT_MS is used.
+
+DEADLINE_RESERVE_MS = int(os.environ.get("DEADLINE_RESERVE_MS", "1500"))
+DEADLINE_DEFAULT_MS = int(os.environ.get("DEADLINE_DEFAULT_MS", "900000"))
+
+class Deadline:
+    def __init__(self, context=None, reserve_ms=DEADLINE_RESERVE_MS):
+        remaining = context.get_remaining_time_in_millis() if context is not None else DEADLINE_DEFAULT_MS
+        self.ends_at = time.monotonic() + max(0, remaining - reserve_ms) / 1000
+
+    def remaining_s(self):
+        return max(0.0, self.ends_at - time.monotonic())
+
+    def has(self, seconds):
+        return self.remaining_s() >= seconds
+
+    def budget_s(self, keep_s=0.0, cap_s=None):
+        # Time a stage may use while leaving keep_s for the stages after it
+        budget = max(0.0, self.remaining_s() - keep_s)
+        return min(budget, cap_s) if cap_s is not None else budget
+
+def run_stages(stages, timeout_s):
+    # Run {name: fn} concurrently for at most timeout_s.
+    # Returns ({name: result}, [stages still running at the deadline], {name: error}).
+    # Threads of unfinished stages are abandoned rather than waited for.
+    executor = ThreadPoolExecutor(max_workers=max(1, len(stages)))
+    futures = {executor.submit(fn): name for name, fn in stages.items()}
+    done, not_done = wait(futures, timeout=timeout_s)
+    results, errors = {}, {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            errors[futures[future]] = str(e)
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False)
+    unfinished = [name for name in stages if name not in results and name not in errors]
+    return results, unfinished, errors
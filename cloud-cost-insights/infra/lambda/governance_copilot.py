@@ -1,53 +1,93 @@
 import json
-import boto3
 import os
 import requests
+from aws_clients import get_client
+from deadline import Deadline, run_stages
+from sonar_transport import post_chat
+from resource_collectors import iter_instances
+from prompt_compaction import compact_records, map_reduce_summarize
 
-def ask_sonar(prompt: str) -> str:
+# Below this much time left the Sonar call is skipped; it never gets more than the max
+GOVERNANCE_SUMMARY_MIN_SECONDS = float(os.environ.get("GOVERNANCE_SUMMARY_MIN_SECONDS", "3"))
+GOVERNANCE_SUMMARY_MAX_SECONDS = float(os.environ.get("GOVERNANCE_SUMMARY_MAX_SECONDS", "30"))
+# Time the EC2 describe stage may use before the rest goes to the summary
+GOVERNANCE_DESCRIBE_MAX_SECONDS = float(os.environ.get("GOVERNANCE_DESCRIBE_MAX_SECONDS", "8"))
+GOVERNANCE_MAX_INSTANCES = int(os.environ.get("GOVERNANCE_MAX_INSTANCES", "1000"))
+
+# Instance fields the governance analysis looks at; instances that differ only in the
+# identity fields are folded into one group with a count
+GOVERNANCE_INSTANCE_FIELDS = [
+    "InstanceId", "InstanceType", "ImageId", "State.Name", "Tags", "Placement.AvailabilityZone",
+    "VpcId", "SubnetId", "IamInstanceProfile.Arn", "KeyName", "Platform", "LaunchTime",
+]
+GOVERNANCE_IDENTITY_FIELDS = ("InstanceId", "LaunchTime")
+
+def ask_sonar(prompt: str, timeout: float = 30) -> str:
     api_key = os.environ.get("SONAR_API_KEY")
     if not api_key:
         raise Exception("Missing SONAR_API_KEY in environment variables.")
 
-    response = requests.post(
-        url="https://api.perplexity.ai/chat/completions",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        },
-        json={
-            "model": "sonar-pro",
-            "messages": [
-                {"role": "system", "content": "You are a Terraform governance expert."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.4
-        },
-        timeout=30
-    )
+    payload = {
+        "model": "sonar-pro",
+        "messages": [
+            {"role": "system", "content": "You are a Terraform governance expert."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.4
+    }
 
+    # Timeouts propagate so the handler can return a partial result
+    try:
+        data = post_chat(payload, api_key, timeout=timeout)
+    except requests.exceptions.HTTPError as e:
+        raise Exception(f"Failed to parse Sonar response: {e.response.text}")
     try:
-        return response.json()["choices"][0]["message"]["content"]
+        return data["choices"][0]["message"]["content"]
     except Exception:
-        raise Exception(f"Failed to parse Sonar response: {response.text}")
+        raise Exception(f"Failed to parse Sonar response: {data}")
+
+def collect_instances(ec2):
+    instances = []
+    for instance in iter_instances(ec2):
+        instances.append(instance)
+        if len(instances) >= GOVERNANCE_MAX_INSTANCES:
+            break
+    return instances
 
 def lambda_handler(event, context):
-    ec2 = boto3.client("ec2")
-    instances = ec2.describe_instances(MaxResults=5)
+    deadline = Deadline(context)
+    ec2 = get_client("ec2")
+    results, unfinished, errors = run_stages(
+        {"describe_instances": lambda: collect_instances(ec2)},
+        deadline.budget_s(keep_s=GOVERNANCE_SUMMARY_MIN_SECONDS, cap_s=GOVERNANCE_DESCRIBE_MAX_SECONDS),
+    )
+    if "describe_instances" not in results:
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "terraform": "EC2 instance metadata could not be collected in time.",
+                "partial": True,
+                "unfinished_stages": ["describe_instances", "summary"],
+                **({"stage_errors": errors} if errors else {}),
+            })
+        }
+    all_instances = results["describe_instances"]
 
-    if not instances.get("Reservations"):
+    if not all_instances:
         return {
             "statusCode": 200,
             "body": json.dumps({"terraform": "No EC2 instances found."})
         }
 
-    all_instances = []
-    for res in instances["Reservations"]:
-        all_instances.extend(res["Instances"])
+    records = compact_records(all_instances, GOVERNANCE_INSTANCE_FIELDS, GOVERNANCE_IDENTITY_FIELDS)
 
-    prompt = f"""
-You are an expert in AWS Cloud Governance. Below is metadata from live EC2 instances:
+    def build_prompt(data, part):
+        scope = f" (part {part} of the fleet)" if part else ""
+        return f"""
+You are an expert in AWS Cloud Governance. Below is metadata from live EC2 instances{scope}.
+Instances that share every field apart from their id and launch time are folded into one entry with a count and sample ids:
 
-{json.dumps(all_instances, indent=2, default=str)}
+{data}
 
 Please analyze them and:
 - Flag missing or inconsistent tags (e.g. Name, Environment).
@@ -57,9 +97,46 @@ Please analyze them and:
 - If everything looks good, say so. Do NOT return generic placeholders.
 """
 
-    terraform_code = ask_sonar(prompt)
+    if not deadline.has(GOVERNANCE_SUMMARY_MIN_SECONDS):
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "terraform": f"Collected {len(all_instances)} instance(s) but not enough time was left for the analysis.",
+                "partial": True,
+                "unfinished_stages": ["summary"],
+                "instance_ids": [i["InstanceId"] for i in all_instances],
+            })
+        }
+    try:
+        terraform_code = map_reduce_summarize(
+            records, build_prompt,
+            lambda prompt: ask_sonar(prompt, timeout=deadline.budget_s(cap_s=GOVERNANCE_SUMMARY_MAX_SECONDS))
+        )
+    except requests.exceptions.Timeout:
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "terraform": "The analysis did not finish before the function deadline.",
+                "partial": True,
+                "unfinished_stages": ["summary"],
+                "instance_ids": [i["InstanceId"] for i in all_instances],
+            })
+        }
+    except Exception as e:
+        # Sonar errors after retries, dropped connections or unparseable replies still
+        # return the instances collected so far
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "terraform": "The analysis failed; see stage_errors.",
+                "partial": True,
+                "unfinished_stages": ["summary"],
+                "stage_errors": {"summary": str(e)},
+                "instance_ids": [i["InstanceId"] for i in all_instances],
+            })
+        }
 
     return {
         "statusCode": 200,
-        "body": json.dumps({"terraform": terraform_code})
+        "body": json.dumps({"terraform": terraform_code, "partial": False, "unfinished_stages": []})
     }
@@ -1,60 +1,191 @@
-import boto3
+import os
 import json
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
+from aws_clients import get_client
+from scan_cache import cached_scan_response
+from deadline import Deadline
+from resource_collectors import iter_volumes, iter_addresses, iter_network_interfaces, ndjson_line
 
-ec2 = boto3.client("ec2")
+ec2 = get_client("ec2")
 
-def get_unattached_volumes():
-    resp = ec2.describe_volumes(Filters=[{"Name": "status", "Values": ["available"]}])
-    return [
-        {
+# Comma-separated regions to scan; empty means every region enabled for the account
+ORPHAN_SCAN_REGIONS = [r.strip() for r in os.environ.get("ORPHAN_SCAN_REGIONS", "").split(",") if r.strip()]
+ORPHAN_SCAN_WORKERS = int(os.environ.get("ORPHAN_SCAN_WORKERS", "8"))
+# Wall-clock budget for the whole scan; regions still running after it are reported as timed out
+ORPHAN_SCAN_TIMEOUT_SECONDS = float(os.environ.get("ORPHAN_SCAN_TIMEOUT_SECONDS", "20"))
+
+def iter_unattached_volumes(client):
+    for v in iter_volumes(client, Filters=[{"Name": "status", "Values": ["available"]}]):
+        yield {
             "VolumeId": v["VolumeId"],
             "Size": v["Size"],
             "CreateTime": v["CreateTime"].astimezone(timezone.utc).isoformat(),
             "AvailabilityZone": v.get("AvailabilityZone"),
         }
-        for v in resp.get("Volumes", [])
-    ]
-
-def get_unassociated_eips():
-    resp = ec2.describe_addresses()
-    return [
-        {
-            "PublicIp": eip["PublicIp"],
-            "AllocationId": eip.get("AllocationId"),
-            "Domain": eip.get("Domain"),
-        }
-        for eip in resp.get("Addresses", [])
-        if not eip.get("AssociationId")
-    ]
-
-def get_unused_enis():
-    resp = ec2.describe_network_interfaces(Filters=[{"Name": "status", "Values": ["available"]}])
-    return [
-        {
-            "NetworkInterfaceId": eni["NetworkInterfaceId"],
-            "Description": eni.get("Description"),
-            "AvailabilityZone": eni.get("AvailabilityZone"),
+
+def iter_unassociated_eips(client):
+    for eip in iter_addresses(client):
+        if not eip.get("AssociationId"):
+            yield {
+                "PublicIp": eip["PublicIp"],
+                "AllocationId": eip.get("AllocationId"),
+                "Domain": eip.get("Domain"),
+            }
+
+def iter_unused_enis(client):
+    for eni in iter_network_interfaces(client, Filters=[{"Name": "status", "Values": ["available"]}]):
+        if not eni.get("Attachment"):
+            yield {
+                "NetworkInterfaceId": eni["NetworkInterfaceId"],
+                "Description": eni.get("Description"),
+                "AvailabilityZone": eni.get("AvailabilityZone"),
+            }
+
+def get_unattached_volumes(client=None):
+    return list(iter_unattached_volumes(client or ec2))
+
+def get_unassociated_eips(client=None):
+    return list(iter_unassociated_eips(client or ec2))
+
+def get_unused_enis(client=None):
+    return list(iter_unused_enis(client or ec2))
+
+COLLECTORS = {
+    "unattached_volumes": iter_unattached_volumes,
+    "unassociated_eips": iter_unassociated_eips,
+    "unused_network_interfaces": iter_unused_enis,
+}
+
+def list_enabled_regions():
+    resp = ec2.describe_regions(Filters=[{"Name": "opt-in-status", "Values": ["opt-in-not-required", "opted-in"]}])
+    return sorted(r["RegionName"] for r in resp.get("Regions", []))
+
+class RecordSink:
+    # Receives records from the region threads as they are collected. Once closed, records
+    # from abandoned slow regions are dropped so the response can be serialized safely.
+
+    def __init__(self, write):
+        self.write = write
+        self.lock = threading.Lock()
+        self.closed = False
+        self.counts = {}
+
+    def __call__(self, kind, record):
+        with self.lock:
+            if self.closed:
+                return
+            self.write(kind, record)
+            self.counts[record["Region"]] = self.counts.get(record["Region"], 0) + 1
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+def scan_region(region, sink):
+    # Every record is tagged with its region so results can be merged across regions
+    started = time.perf_counter()
+    client = get_client("ec2", region)
+    error = None
+    try:
+        for kind, collect in COLLECTORS.items():
+            for record in collect(client):
+                sink(kind, {**record, "Region": region})
+    except Exception as e:
+        error = str(e)
+    return round((time.perf_counter() - started) * 1000), error
+
+def scan_regions(regions, sink, timeout=ORPHAN_SCAN_TIMEOUT_SECONDS):
+    # Scan regions concurrently, streaming records into sink; returns the per-region status.
+    # Records a slow region produced before the timeout are kept; its status says it is incomplete.
+    status = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, min(ORPHAN_SCAN_WORKERS, len(regions))))
+    futures = {executor.submit(scan_region, region, sink): region for region in regions}
+    done, not_done = wait(futures, timeout=timeout)
+    sink.close()
+    for future in done:
+        region = futures[future]
+        try:
+            duration_ms, error = future.result()
+        except Exception as e:
+            # Client creation failed before the region scan started
+            duration_ms, error = 0, str(e)
+        if error:
+            status[region] = {"status": "error", "duration_ms": duration_ms, "error": error}
+        else:
+            status[region] = {"status": "ok", "duration_ms": duration_ms}
+    for future in not_done:
+        future.cancel()
+        status[futures[future]] = {
+            "status": "timeout",
+            "duration_ms": round(timeout * 1000),
+            "error": f"Region scan did not finish within {timeout:g}s",
         }
-        for eni in resp.get("NetworkInterfaces", [])
-        if not eni.get("Attachment")
-    ]
+    for region in status:
+        status[region]["records"] = sink.counts.get(region, 0)
+    # Do not wait for slow regions; their threads are abandoned with the invocation
+    executor.shutdown(wait=False)
+    return dict(sorted(status.items()))
 
 def lambda_handler(event, context):
     try:
-        volumes = get_unattached_volumes()
-        eips = get_unassociated_eips()
-        enis = get_unused_enis()
+        try:
+            body = json.loads((event or {}).get("body") or "{}")
+        except json.JSONDecodeError:
+            return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
+        requested_regions = body.get("regions") or ORPHAN_SCAN_REGIONS
+        # Region scans stop at ORPHAN_SCAN_TIMEOUT_SECONDS or when the invocation is about to time out
+        deadline = Deadline(context)
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "unattached_volumes": volumes,
-                "unassociated_eips": eips,
-                "unused_network_interfaces": enis,
-            }, indent=2)
-        }
+        if body.get("format") == "ndjson":
+            # One line per record as it is collected, then per-region status and an end line
+            regions = requested_regions or list_enabled_regions()
+            timestamp = datetime.now(timezone.utc).isoformat()
+            out = io.StringIO()
+            out.write(ndjson_line("meta", timestamp=timestamp, regions=regions))
+            sink = RecordSink(lambda kind, record: out.write(ndjson_line("record", kind=kind, record=record)))
+            region_status = scan_regions(regions, sink, deadline.budget_s(cap_s=ORPHAN_SCAN_TIMEOUT_SECONDS))
+            for region, region_info in region_status.items():
+                out.write(ndjson_line("region", region=region, **region_info))
+            out.write(ndjson_line(
+                "end",
+                records=sum(sink.counts.values()),
+                partial=any(s["status"] != "ok" for s in region_status.values()),
+                unfinished_stages=[r for r, s in region_status.items() if s["status"] == "timeout"],
+            ))
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/x-ndjson"},
+                "body": out.getvalue()
+            }
+
+        def scan(previous):
+            # Region discovery only happens when a scan actually runs
+            regions = requested_regions or list_enabled_regions()
+            timestamp = datetime.now(timezone.utc).isoformat()
+            results = {name: [] for name in COLLECTORS}
+            region_status = scan_regions(
+                regions,
+                RecordSink(lambda kind, record: results[kind].append(record)),
+                deadline.budget_s(cap_s=ORPHAN_SCAN_TIMEOUT_SECONDS),
+            )
+            return {
+                "timestamp": timestamp,
+                **results,
+                "regions": region_status,
+                "partial": any(s["status"] != "ok" for s in region_status.values()),
+                "unfinished_stages": [r for r, s in region_status.items() if s["status"] == "timeout"],
+            }
+
+        # The ETag covers the findings only, so a rescan that finds the same resources keeps it
+        return cached_scan_response(
+            event, body, "orphaned_resources", scan,
+            params={"regions": sorted(requested_regions)} if requested_regions else None,
+            etag_fields=list(COLLECTORS),
+        )
     except Exception as e:
         return {
             "statusCode": 500,
@@ -1,63 +1,172 @@
-import boto3
 import os
 import json
 from datetime import datetime, timedelta, timezone
+from aws_clients import get_client
+from cost_cache import (
+    daterange, cache_key_for, month_bounds, is_month_closed, is_year_closed, month_rollup_key, year_rollup_key,
+    contiguous_runs, fetch_cost_range, list_day_objects, list_rollups, decode_cache_body, put_cache_body, write_rollup,
+)
 
-ce = boto3.client("ce")
-s3 = boto3.client("s3")
+ce = get_client("ce")
+s3 = get_client("s3")
 
 CACHE_BUCKET = os.environ.get("CACHE_BUCKET_NAME", "")
 CACHE_TTL = int(os.environ.get("CACHE_TTL_MINUTES", "30"))
+PREWARM_BACKFILL_DAYS = int(os.environ.get("PREWARM_BACKFILL_DAYS", "35"))
+PREWARM_GRANULARITIES = [g.strip() for g in os.environ.get("PREWARM_GRANULARITIES", "DAILY,MONTHLY").split(",") if g.strip()]
+CE_REQUEST_COST_USD = 0.01
 
-def cache_key_for(day):
-    return f"cost_cache/DAILY/__ALL__/{day.isoformat()}.json"
+def is_cache_valid(obj):
+    age_minutes = (datetime.now(timezone.utc) - obj["LastModified"]).total_seconds() / 60
+    return age_minutes < CACHE_TTL
 
-def prewarm_yesterday():
-    day = datetime.utcnow().date() - timedelta(days=1)
-    day_str = day.isoformat()
-    end_str = (day + timedelta(days=1)).isoformat()
+def is_complete(obj, day):
+    # Objects written before the day was over only hold that day's partial costs
+    day_end = datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return obj["LastModified"] >= day_end
 
-    print(f"Prewarming cache for {day_str}...")
+def backfill_gaps(window_days=PREWARM_BACKFILL_DAYS, granularities=PREWARM_GRANULARITIES, fetched=None):
+    # Fill missing, expired or partial day keys over the last window_days (up to yesterday)
+    # for every granularity. Each cache object holds one full day regardless of granularity,
+    # so the gaps of all granularities are unioned into contiguous runs and each run costs
+    # one paginated CE request. Valid keys and days covered by rollups are never rewritten.
+    # fetched, if given, receives {day: rows} for every day fetched from CE.
+    report = {"filled": {}, "skipped": {}, "ce_requests": 0, "errors": []}
+    if not CACHE_BUCKET:
+        print("⚠️ CACHE_BUCKET not configured.")
+        return report
 
+    end_date = datetime.utcnow().date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=window_days - 1)
+    print(f"Backfilling cache gaps for {start_date.isoformat()}..{end_date.isoformat()} ({', '.join(granularities)})...")
+
+    gaps = {}
+    for granularity in granularities:
+        try:
+            month_rollups, _ = list_rollups(s3, CACHE_BUCKET, granularity)
+            existing = list_day_objects(s3, CACHE_BUCKET, granularity, start_date, end_date)
+        except Exception as e:
+            report["errors"].append(f"{granularity}: listing failed: {e}")
+            continue
+        gaps[granularity] = set()
+        skipped = 0
+        for day in daterange(start_date, end_date):
+            obj = existing.get(day.isoformat())
+            if (day.year, day.month) in month_rollups or (obj and is_cache_valid(obj) and is_complete(obj, day)):
+                skipped += 1
+            else:
+                gaps[granularity].add(day)
+        report["skipped"][granularity] = skipped
+        report["filled"][granularity] = []
+
+    all_gaps = sorted(set().union(*gaps.values())) if gaps else []
+    stats = {}
+    for run_start, run_end in contiguous_runs(all_gaps):
+        try:
+            rows_by_day = fetch_cost_range(ce, run_start, run_end, stats)
+        except Exception as e:
+            report["errors"].append(f"{run_start.isoformat()}..{run_end.isoformat()}: {e}")
+            continue
+        for day in daterange(run_start, run_end):
+            day_str = day.isoformat()
+            if fetched is not None:
+                fetched[day_str] = rows_by_day.get(day_str, [])
+            for granularity, missing in gaps.items():
+                if day not in missing:
+                    continue
+                try:
+                    put_cache_body(s3, CACHE_BUCKET, cache_key_for(day, granularity), {day_str: rows_by_day.get(day_str, [])})
+                    report["filled"][granularity].append(day_str)
+                except Exception as e:
+                    report["errors"].append(f"{granularity} {day_str}: {e}")
+
+    report["ce_requests"] = stats.get("ce_requests", 0)
+    report["estimated_ce_cost_usd"] = round(report["ce_requests"] * CE_REQUEST_COST_USD, 2)
+    for granularity, filled in report["filled"].items():
+        print(f"✅ {granularity}: filled {len(filled)} day(s), skipped {report['skipped'][granularity]} valid day(s)")
+    print(f"Cost Explorer requests: {report['ce_requests']} (~${report['estimated_ce_cost_usd']:.2f})")
+    return report
+
+def load_settled_days(granularity, first, last, days):
+    # {day: rows} for the given days whose cached object was written after its month closed,
+    # i.e. holds final costs that can go into a rollup
+    settled = {}
+    for day_str, obj in list_day_objects(s3, CACHE_BUCKET, granularity, first, last).items():
+        day = datetime.fromisoformat(day_str).date()
+        if day_str not in days or not is_month_closed(day.year, day.month, obj["LastModified"].date()):
+            continue
+        try:
+            body = s3.get_object(Bucket=CACHE_BUCKET, Key=obj["Key"])["Body"].read()
+            rows = decode_cache_body(body, day_str).get(day_str)
+        except Exception as e:
+            print(f"Could not read cached {day_str}: {e}")
+            continue
+        if rows is not None:
+            settled[day_str] = rows
+    return settled
+
+def compact_rollups(granularities=PREWARM_GRANULARITIES, stats=None, fetched=None):
+    # Roll up the most recent closed month, and the previous year once all twelve of its
+    # month rollups exist. The month's rows come from fetched (days backfill_gaps just pulled
+    # from CE), then settled day objects in S3; only the days still missing cost a CE request,
+    # shared by all granularities. Rollups are never rewritten.
+    if not CACHE_BUCKET:
+        return
+    fetched = fetched or {}
+    today = datetime.utcnow().date()
     try:
-        response = ce.get_cost_and_usage(
-            TimePeriod={"Start": day_str, "End": end_str},
-            Granularity="DAILY",
-            Metrics=["UnblendedCost"],
-            GroupBy=[{"Type": "DIMENSION", "Key": "SERVICE"}],
-        )
-
-        daily_results = []
-        for group in response["ResultsByTime"][0].get("Groups", []):
-            service = group["Keys"][0]
-            cost = group["Metrics"]["UnblendedCost"]["Amount"]
-            daily_results.append({
-                "date": day_str,
-                "service": service,
-                "cost": f"${float(cost):.2f}"
-            })
-
-        if not daily_results:
-            print("No cost data found.")
-
-        if CACHE_BUCKET:
-            key = cache_key_for(day)
-            s3.put_object(
-                Bucket=CACHE_BUCKET,
-                Key=key,
-                Body=json.dumps(daily_results),
-                ContentType="application/json"
-            )
-            print(f"✅ Cached {len(daily_results)} entries to {key}")
-        else:
-            print("⚠️ CACHE_BUCKET not configured.")
+        rollups = {g: list_rollups(s3, CACHE_BUCKET, g) for g in granularities}
+
+        last_month_end = today.replace(day=1) - timedelta(days=1)
+        if not is_month_closed(last_month_end.year, last_month_end.month, today):
+            last_month_end = last_month_end.replace(day=1) - timedelta(days=1)
+        year, month = last_month_end.year, last_month_end.month
+        missing = [g for g in granularities if (year, month) not in rollups[g][0]]
+        if missing:
+            first, last = month_bounds(year, month)
+            month_days = [d.isoformat() for d in daterange(first, last)]
+            month_rows = {d: fetched[d] for d in month_days if d in fetched}
+            remaining = {d for d in month_days if d not in month_rows}
+            if remaining:
+                month_rows.update(load_settled_days(missing[0], first, last, remaining))
+            uncached = [datetime.fromisoformat(d).date() for d in month_days if d not in month_rows]
+            for run_start, run_end in contiguous_runs(uncached):
+                rows_by_day = fetch_cost_range(ce, run_start, run_end, stats)
+                for d in daterange(run_start, run_end):
+                    month_rows[d.isoformat()] = rows_by_day.get(d.isoformat(), [])
+            month_rows = {d: month_rows[d] for d in month_days}
+            for granularity in missing:
+                key = month_rollup_key(year, month, granularity)
+                write_rollup(s3, CACHE_BUCKET, key, month_rows)
+                rollups[granularity][0][(year, month)] = key
 
+        last_year = today.year - 1
+        for granularity in granularities:
+            month_rollups, year_rollups = rollups[granularity]
+            if not is_year_closed(last_year, today) or last_year in year_rollups:
+                continue
+            if not all((last_year, m) in month_rollups for m in range(1, 13)):
+                continue
+            rows_by_day = {}
+            for m in range(1, 13):
+                obj = s3.get_object(Bucket=CACHE_BUCKET, Key=month_rollups[(last_year, m)])
+                rows_by_day.update(decode_cache_body(obj["Body"].read()))
+            write_rollup(s3, CACHE_BUCKET, year_rollup_key(last_year, granularity), rows_by_day)
     except Exception as e:
-        print(f"❌ Error during prewarming: {e}")
+        print(f"❌ Error during rollup compaction: {e}")
 
 def lambda_handler(event, context):
-    prewarm_yesterday()
+    # Scheduled runs use the environment defaults; manual invokes may override the window
+    event = event or {}
+    window_days = int(event.get("backfill_days", PREWARM_BACKFILL_DAYS))
+    granularities = event.get("granularities") or PREWARM_GRANULARITIES
+    fetched = {}
+    report = backfill_gaps(window_days, granularities, fetched)
+    stats = {}
+    compact_rollups(granularities, stats, fetched)
+    report["ce_requests"] += stats.get("ce_requests", 0)
+    report["estimated_ce_cost_usd"] = round(report["ce_requests"] * CE_REQUEST_COST_USD, 2)
     return {
         "statusCode": 200,
-        "body": json.dumps({"message": "Prewarm complete"})
+        "body": json.dumps({"message": "Prewarm complete", **report})
     }
@@ -0,0 +1,36 @@
+import json
+
+# Generator-based AWS collectors shared by the resource scanners.
+#
+# Every describe call is paged to the end, one page at a time, and items are yielded as they
+# arrive, so callers can process or serialize records without holding the whole account in
+# memory. The same module lives in agents/ and in the Lambda source directory.
+
+def paginate(client, operation, result_key, **kwargs):
+    # Yield every item under result_key across all pages; operations without a
+    # paginator (e.g. describe_addresses returns everything at once) get a single call
+    if client.can_paginate(operation):
+        for page in client.get_paginator(operation).paginate(**kwargs):
+            yield from page.get(result_key, [])
+    else:
+        yield from getattr(client, operation)(**kwargs).get(result_key, [])
+
+def iter_instances(ec2, **kwargs):
+    for reservation in paginate(ec2, "describe_instances", "Reservations", **kwargs):
+        yield from reservation.get("Instances", [])
+
+def iter_volumes(ec2, **kwargs):
+    return paginate(ec2, "describe_volumes", "Volumes", **kwargs)
+
+def iter_addresses(ec2, **kwargs):
+    return paginate(ec2, "describe_addresses", "Addresses", **kwargs)
+
+def iter_network_interfaces(ec2, **kwargs):
+    return paginate(ec2, "describe_network_interfaces", "NetworkInterfaces", **kwargs)
+
+def iter_buckets(s3):
+    return paginate(s3, "list_buckets", "Buckets")
+
+def ndjson_line(record_type, **fields):
+    # Record payloads go under their own field (e.g. record=...) so their keys never clash with "type"
+    return json.dumps({"type": record_type, **fields}, default=str) + "\n"
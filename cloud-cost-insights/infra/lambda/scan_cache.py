@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from aws_clients import get_client
+
+# Materialized scan results for the security and orphaned-resource endpoints.
+#
+# A scan result is stored with the time it was produced and a content ETag, in the warm
+# container and (when SCAN_CACHE_BUCKET or CACHE_BUCKET_NAME is set) in S3 under
+#   scan_results/<scanner>/<variant>.json
+# Requests get the stored result while it is younger than SCAN_CACHE_TTL_SECONDS, with its
+# age; "If-None-Match" with the current ETag returns 304 without a body. A fresh scan runs
+# only when nothing usable is stored or the caller asks for it with {"refresh": true}
+# (or ?refresh=true). Partial results are returned but never stored.
+
+SCAN_CACHE_BUCKET = os.environ.get("SCAN_CACHE_BUCKET") or os.environ.get("CACHE_BUCKET_NAME", "")
+SCAN_CACHE_TTL_SECONDS = int(os.environ.get("SCAN_CACHE_TTL_SECONDS", "900"))
+
+memory_entries = {}
+
+def content_etag(payload):
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+def variant_key(params):
+    # Stable name for the request parameters that change the scan (e.g. the region list)
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16] if params else "default"
+
+def object_key(scanner, variant):
+    return f"scan_results/{scanner}/{variant}.json"
+
+def load_entry(scanner, variant):
+    entry = memory_entries.get((scanner, variant))
+    if entry is None and SCAN_CACHE_BUCKET:
+        try:
+            obj = get_client("s3").get_object(Bucket=SCAN_CACHE_BUCKET, Key=object_key(scanner, variant))
+            entry = json.loads(obj["Body"].read())
+            memory_entries[(scanner, variant)] = entry
+        except Exception as e:
+            if "NoSuchKey" not in str(e):
+                print(f"Scan cache read failed for {scanner}/{variant}: {e}")
+    return entry
+
+def store_entry(scanner, variant, entry):
+    memory_entries[(scanner, variant)] = entry
+    if not SCAN_CACHE_BUCKET:
+        return
+    try:
+        get_client("s3").put_object(
+            Bucket=SCAN_CACHE_BUCKET,
+            Key=object_key(scanner, variant),
+            Body=json.dumps(entry, default=str).encode("utf-8"),
+            ContentType="application/json"
+        )
+    except Exception as e:
+        print(f"Scan cache write failed for {scanner}/{variant}: {e}")
+
+def entry_age_seconds(entry, now=None):
+    now = now or datetime.now(timezone.utc)
+    return (now - datetime.fromisoformat(entry["generated_at"])).total_seconds()
+
+def wants_refresh(event, body):
+    query = (event or {}).get("queryStringParameters") or {}
+    return bool(body.get("refresh")) or str(query.get("refresh", "")).lower() in ("1", "true", "yes")
+
+def if_none_match(event):
+    headers = {k.lower(): v for k, v in ((event or {}).get("headers") or {}).items()}
+    return headers.get("if-none-match")
+
+def cached_scan_response(event, body, scanner, scan, params=None, etag_fields=None):
+    # scan(previous_result) runs the live scan; previous_result is the stored result (or None)
+    # so scanners can reuse expensive parts such as an unchanged AI summary.
+    # etag_fields limits the ETag to the result keys that carry content (e.g. not timestamps).
+    variant = variant_key(params)
+    entry = load_entry(scanner, variant)
+    age = entry_age_seconds(entry) if entry else None
+
+    if entry is None or age >= SCAN_CACHE_TTL_SECONDS or wants_refresh(event, body):
+        result = scan(entry["result"] if entry else None)
+        etag_payload = {k: result.get(k) for k in etag_fields} if etag_fields else result
+        entry = {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "etag": content_etag(etag_payload),
+            "result": result,
+        }
+        if not result.get("partial"):
+            store_entry(scanner, variant, entry)
+        age, cached = 0, False
+    else:
+        cached = True
+
+    headers = {
+        "ETag": entry["etag"],
+        "Age": str(int(age)),
+        "Cache-Control": f"private, max-age={max(0, int(SCAN_CACHE_TTL_SECONDS - age))}",
+    }
+    if if_none_match(event) == entry["etag"]:
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {
+        "statusCode": 200,
+        "headers": {**headers, "Content-Type": "application/json"},
+        "body": json.dumps({
+            **entry["result"],
+            "cached": cached,
+            "generated_at": entry["generated_at"],
+            "age_seconds": int(age),
+        }, default=str)
+    }
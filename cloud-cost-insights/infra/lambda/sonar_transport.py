@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared HTTP transport for every Sonar (Perplexity) caller.
+#
+# One keep-alive requests.Session per process, so repeated calls reuse pooled TLS
+# connections. 429 and 5xx responses are retried with exponential backoff and full jitter,
+# honoring Retry-After. A client-side token bucket spaces out requests before the API has
+# to push back. The timeout passed to post_chat bounds the whole call, retries and waits
+# included; for stream_chat it bounds getting the response started, and then each read.
+# The same module lives in ai/ and in the Lambda source directory.
+
+SONAR_ENDPOINT = os.getenv("SONAR_ENDPOINT", "https://api.perplexity.ai/chat/completions")
+SONAR_MAX_RETRIES = int(os.getenv("SONAR_MAX_RETRIES", "4"))
+SONAR_BACKOFF_BASE_SECONDS = float(os.getenv("SONAR_BACKOFF_BASE_SECONDS", "0.5"))
+SONAR_BACKOFF_MAX_SECONDS = float(os.getenv("SONAR_BACKOFF_MAX_SECONDS", "8"))
+SONAR_RATE_PER_SECOND = float(os.getenv("SONAR_RATE_PER_SECOND", "1"))
+SONAR_BURST = int(os.getenv("SONAR_BURST", "3"))
+SONAR_POOL_SIZE = int(os.getenv("SONAR_POOL_SIZE", "10"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        # Take one token, waiting for it if needed; False if it would take longer than timeout
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if give_up_at is not None and time.monotonic() + wait > give_up_at:
+                return False
+            time.sleep(wait)
+
+limiter = TokenBucket(SONAR_RATE_PER_SECOND, SONAR_BURST)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # Retries are handled in post_chat so they can honor Retry-After and the limiter
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SONAR_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_seconds(attempt):
+    return random.uniform(0, min(SONAR_BACKOFF_MAX_SECONDS, SONAR_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+def send_chat(payload, api_key, timeout=30, stream=False):
+    # POST a chat completion and return the successful response. Raises requests exceptions:
+    # Timeout when the budget runs out, HTTPError once retries are exhausted.
+    give_up_at = time.monotonic() + timeout
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream" if stream else "application/json"
+    }
+    for attempt in range(SONAR_MAX_RETRIES + 1):
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0 or not limiter.acquire(timeout=remaining):
+            raise requests.exceptions.Timeout(f"Sonar request did not complete within {timeout:g}s")
+        try:
+            res = get_session().post(SONAR_ENDPOINT, headers=headers, json=payload, stream=stream, timeout=max(0.1, give_up_at - time.monotonic()))
+        except requests.exceptions.ConnectionError:
+            # Dropped keep-alive connections and resets are worth another attempt
+            if attempt == SONAR_MAX_RETRIES:
+                raise
+            delay = backoff_seconds(attempt)
+            if time.monotonic() + delay >= give_up_at:
+                raise
+            time.sleep(delay)
+            continue
+        if res.status_code in RETRY_STATUS_CODES and attempt < SONAR_MAX_RETRIES:
+            delay = retry_after_seconds(res)
+            delay = backoff_seconds(attempt) if delay is None else delay
+            if time.monotonic() + delay < give_up_at:
+                res.close()
+                time.sleep(delay)
+                continue
+        res.raise_for_status()
+        return res
+
+def post_chat(payload, api_key, timeout=30):
+    # Return the decoded JSON body of a chat completion
+    return send_chat(payload, api_key, timeout=timeout).json()
+
+def stream_chat(payload, api_key, timeout=30):
+    # Yield the content deltas of a chat completion as the server-sent events arrive.
+    # Only the request itself is retried; a stream that breaks off raises.
+    res = send_chat({**payload, "stream": True}, api_key, timeout=timeout, stream=True)
+    with res:
+        # Split raw bytes and decode each line as UTF-8, which server-sent events always are.
+        # Decoding with the response's default charset (ISO-8859-1 for text/event-stream)
+        # would turn bytes like \x85 into line breaks in the middle of an event.
+        for raw in res.iter_lines():
+            line = raw.decode("utf-8")
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            choices = json.loads(data).get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
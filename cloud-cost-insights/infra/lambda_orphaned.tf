@@ -5,6 +5,16 @@ resource "aws_lambda_function" "orphaned_resources" {
   runtime          = "python3.9"
   role             = aws_iam_role.lambda_exec_role.arn
   source_code_hash = filebase64sha256(data.archive_file.lambda_zip_orphaned.output_path)
+  timeout          = 30
+
+  environment {
+    variables = {
+      ORPHAN_SCAN_REGIONS         = ""
+      ORPHAN_SCAN_TIMEOUT_SECONDS = "20"
+      SCAN_CACHE_BUCKET           = aws_s3_bucket.cost_cache.bucket
+      SCAN_CACHE_TTL_SECONDS      = "900"
+    }
+  }
 
   tags = {
     Name      = "OrphanedResourceScanner"
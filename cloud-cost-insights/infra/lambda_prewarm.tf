@@ -5,11 +5,14 @@ resource "aws_lambda_function" "cache_prewarm" {
   handler          = "prewarm.lambda_handler"
   runtime          = "python3.9"
   source_code_hash = filebase64sha256(data.archive_file.lambda_zip_prewarm.output_path)
+  timeout          = 120
 
   environment {
     variables = {
-      CACHE_BUCKET_NAME = aws_s3_bucket.cost_cache.bucket
-      CACHE_TTL_MINUTES = "1440"
+      CACHE_BUCKET_NAME     = aws_s3_bucket.cost_cache.bucket
+      CACHE_TTL_MINUTES     = "1440"
+      PREWARM_BACKFILL_DAYS = "35"
+      PREWARM_GRANULARITIES = "DAILY,MONTHLY"
     }
   }
 
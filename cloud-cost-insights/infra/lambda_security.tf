@@ -10,7 +10,9 @@ resource "aws_lambda_function" "security_guard" {
 
   environment {
     variables = {
-      SONAR_API_KEY = var.sonar_api_key
+      SONAR_API_KEY          = var.sonar_api_key
+      SCAN_CACHE_BUCKET      = aws_s3_bucket.cost_cache.bucket
+      SCAN_CACHE_TTL_SECONDS = "900"
     }
   }
 
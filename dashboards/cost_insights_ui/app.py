@@ -44,6 +44,61 @@ if services_cache_file.exists():
 else:
     aws_services = default_services
 
+def stream_cost_rows(payload, page_size=500):
+    # Follow the NDJSON cursor pages of the cost-insights API, yielding each page's rows as soon as it is read
+    cursor = None
+    while True:
+        page_payload = {**payload, "format": "ndjson", "page_size": page_size}
+        if cursor:
+            page_payload["cursor"] = cursor
+        with requests.post(endpoint, json=page_payload, timeout=30, stream=True) as resp:
+            rows, cursor = [], None
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("error"):
+                    raise RuntimeError(record["error"])
+                if record.get("type") == "row":
+                    rows.append({k: v for k, v in record.items() if k != "type"})
+                elif record.get("type") == "end":
+                    cursor = record.get("next_cursor")
+        yield rows
+        if not cursor:
+            return
+
+def post_scan(url, refresh=False, timeout=40):
+    # Scan endpoints return a stored result with its age unless refresh is requested; the last
+    # result and its ETag are kept in the session so an unchanged result comes back as a bodyless 304
+    last = st.session_state.get(f"scan:{url}")
+    headers = {"If-None-Match": last["etag"]} if last and not refresh else {}
+    resp = requests.post(url, json={"refresh": refresh}, headers=headers, timeout=timeout)
+    if resp.status_code == 304 and last:
+        return {**last["data"], "cached": True, "age_seconds": int(resp.headers.get("Age", 0))}
+    data = resp.json()
+    if resp.headers.get("ETag"):
+        st.session_state[f"scan:{url}"] = {"etag": resp.headers["ETag"], "data": data}
+    return data
+
+def show_scan_age(data):
+    if data.get("cached"):
+        st.caption(f"♻️ Cached result from {data['age_seconds']}s ago — tick \"Force rescan\" for a live scan.")
+
+def show_sonar_cache_stats():
+    # Agents run in this process, so the Sonar response cache counters are the dashboard's own
+    from ai.response_cache import get_cache_stats
+    stats = get_cache_stats()
+    st.caption(f"💾 Sonar response cache: {stats['hits']} hit(s), {stats['misses']} miss(es) this session")
+
+def cost_frame(data):
+    # The tab always asks the Lambda to aggregate, so rows are numeric and keyed by the
+    # requested time bucket; label that bucket as "date" for charting
+    frame = pd.DataFrame(data["results"])
+    time_field = next((g for g in data["aggregate"]["group_by"] if g != "service"), None)
+    if time_field and time_field != "date":
+        frame = frame.rename(columns={time_field: "date"})
+    return frame
+
 # Tabs
 tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["💰 Cost Insights", "🧹 Resource Scanner", "🧠 AI Risk & Cost Summary", "🛡️ Security Insights", "🤖 Infra Autopilot", "📊 Governance Copilot"])
 
@@ -60,6 +115,9 @@ with tab1:
     granularity = st.sidebar.selectbox("Granularity", ["DAILY", "MONTHLY"])
     ignore_cache = st.sidebar.checkbox("Bypass Cache (force fresh data)", value=False)
     selected_services = st.sidebar.multiselect("Filter by Service(s)", aws_services)
+    trend_bucket = st.sidebar.selectbox("Trend Interval", ["date", "week", "month"])
+    top_n = st.sidebar.number_input("Top N Services (0 = all)", min_value=0, value=0, step=1)
+    load_raw_rows = st.sidebar.checkbox("Load raw rows (paged)", value=False)
 
     if st.sidebar.button("Fetch Costs"):
         if not endpoint:
@@ -76,6 +134,10 @@ with tab1:
             }
             if selected_services:
                 payload["service"] = selected_services
+            # Let the Lambda aggregate so the payload does not grow with days x services
+            payload["aggregate"] = {"group_by": [trend_bucket, "service"]}
+            if top_n:
+                payload["aggregate"]["top_n"] = int(top_n)
 
             try:
                 response = requests.post(endpoint, json=payload, timeout=15)
@@ -84,18 +146,16 @@ with tab1:
 
                 if "results" not in data:
                     st.error(f"API Error: {data}")
-                elif not data["results"]:
-                    st.warning("No results returned for the selected range.")
                 else:
-                    results = pd.DataFrame(data["results"])
+                    results = cost_frame(data)
 
-                    if "cost" not in results.columns:
+                    if results.empty:
+                        st.warning("No results returned for the selected range.")
+                    elif "cost" not in results.columns:
                         st.error("Missing 'cost' in results. Check Lambda logic.")
                     else:
-                        results["cost"] = results["cost"].str.replace("$", "").astype(float)
-
                         # Update cache file with new services
-                        discovered = sorted(set(results["service"].dropna()))
+                        discovered = sorted(set(results["service"].dropna()) - {"Other"})
                         if discovered:
                             current_set = set(aws_services)
                             new_set = current_set.union(discovered)
@@ -111,7 +171,9 @@ with tab1:
 
                         hits = data.get("cache_hits")
                         misses = data.get("cache_misses")
-                        if hits is not None and misses is not None:
+                        if isinstance(hits, dict) and misses is not None:
+                            st.markdown(f"📦 **Cache**: {hits.get('memory', 0)} memory hit(s), {hits.get('s3', 0)} S3 hit(s), {misses} miss(es)")
+                        elif hits is not None and misses is not None:
                             st.markdown(f"📦 **Cache**: {hits} hit(s), {misses} miss(es)")
 
                         st.subheader("📈 Cost Trends Over Time (in Dollars)")
@@ -124,6 +186,20 @@ with tab1:
                         breakdown = results.groupby("service")["cost"].sum().sort_values(ascending=False)
                         st.bar_chart(breakdown)
 
+                        if load_raw_rows:
+                            st.subheader("🧾 Raw Cost Rows")
+                            raw_status = st.empty()
+                            raw_table = st.empty()
+                            raw_frames = []
+                            # The aggregate call above already fetched fresh data when the cache was bypassed
+                            raw_payload = {k: v for k, v in payload.items() if k not in ("aggregate", "ignore_cache")}
+                            for page in stream_cost_rows(raw_payload):
+                                raw_frames.append(pd.DataFrame(page))
+                                raw_df = pd.concat(raw_frames, ignore_index=True)
+                                raw_status.caption(f"Loaded {len(raw_df)} rows...")
+                                raw_table.dataframe(raw_df)
+                            raw_status.caption(f"Loaded {sum(len(f) for f in raw_frames)} rows.")
+
             except Exception as e:
                 status_msg.empty()
                 st.exception(f"Failed to fetch or process data: {e}")
@@ -135,14 +211,19 @@ with tab2:
     st.subheader("🧹 Orphaned Resources Scanner")
     st.markdown("This checks for unused AWS infrastructure that may be costing you money.")
 
+    refresh_orphaned = st.checkbox("Force rescan", value=False, key="refresh_orphaned")
+
     if st.button("Scan for Orphaned Resources"):
         if not orphaned_endpoint:
             st.error("Orphaned resource endpoint missing.")
         else:
             with st.spinner("Scanning..."):
                 try:
-                    orphaned_response = requests.post(orphaned_endpoint, json={}, timeout=20)
-                    orphaned_data = orphaned_response.json()
+                    orphaned_data = post_scan(orphaned_endpoint, refresh=refresh_orphaned, timeout=40)
+                    show_scan_age(orphaned_data)
+                    if orphaned_data.get("partial"):
+                        failed = [r for r, s in orphaned_data["regions"].items() if s["status"] != "ok"]
+                        st.warning(f"⚠️ Partial results: {len(failed)} region(s) did not finish ({', '.join(failed)})")
                     if "unattached_volumes" in orphaned_data and orphaned_data["unattached_volumes"]:
                         st.success(f"Found {len(orphaned_data['unattached_volumes'])} unattached EBS volumes")
                         orphaned_df = pd.DataFrame(orphaned_data["unattached_volumes"])
@@ -156,6 +237,10 @@ with tab2:
                     if orphaned_data.get("unused_network_interfaces"):
                         st.warning("⚠️ Found unused Network Interfaces")
                         st.dataframe(pd.DataFrame(orphaned_data["unused_network_interfaces"]))
+
+                    if orphaned_data.get("regions"):
+                        with st.expander("🌍 Per-region scan status"):
+                            st.dataframe(pd.DataFrame.from_dict(orphaned_data["regions"], orient="index"))
                 except Exception as e:
                     st.error("Failed to fetch orphaned resource data")
                     st.exception(e)
@@ -166,6 +251,12 @@ with tab3:
     st.subheader("🧠 AI-Powered Infra + Cost Summary")
     st.markdown("This agent summarizes risks, anomalies, and cost insights using your live AWS data.")
 
+    full_inventory = st.checkbox(
+        "Summarize full inventory",
+        value=False,
+        help="By default only resources added, removed or changed since the last run are summarized."
+    )
+
     if st.button("Run Inventory Agent"):
         with st.spinner("Querying AWS + Generating Sonar Summary..."):
             try:
@@ -174,14 +265,28 @@ with tab3:
                 root_path = Path(__file__).resolve().parent.parent.parent  # safely go up to root
                 sys.path.append(str(root_path))
                 from agents.inventory_guard import summarize_inventory
-                result = summarize_inventory()
+                result = summarize_inventory(full=full_inventory, stream=True)
 
-                st.success("Summary generated!")
+                # The summary is rendered token by token as Sonar streams it
                 st.markdown("### 🔍 Summary")
-                st.markdown(result["summary"])
+                st.write_stream(result["summary"])
+                st.success("Summary generated!")
 
-                with st.expander("📦 Raw AWS Inventory"):
-                    st.json(result["raw"], expanded=False)
+                if "changes" in result:
+                    changes = result["changes"]
+                    st.caption(f"Changes since {result['since']}")
+                    col1, col2, col3, col4 = st.columns(4)
+                    col1.metric("Added", len(changes["added"]))
+                    col2.metric("Removed", len(changes["removed"]))
+                    col3.metric("Changed", len(changes["changed"]))
+                    col4.metric("Unchanged", changes["unchanged"])
+                    if changes["added"] or changes["removed"] or changes["changed"]:
+                        with st.expander("🔀 Inventory Changes"):
+                            st.json({k: changes[k] for k in ("added", "removed", "changed")}, expanded=False)
+                else:
+                    with st.expander("📦 Raw AWS Inventory"):
+                        st.json(result["raw"], expanded=False)
+                show_sonar_cache_stats()
 
             except Exception as e:
                 st.error("Agent failed to run")
@@ -203,19 +308,23 @@ with tab4:
     except Exception as e:
         st.warning(f"Could not parse API endpoint: {e}")
 
+    refresh_security = st.checkbox("Force rescan", value=False, key="refresh_security")
+
     if st.button("Run Security Check"):
         if not security_endpoint:
             st.error("Security Guard API endpoint not found.")
         else:
             with st.spinner("Scanning AWS config for vulnerabilities..."):
                 try:
-                    sec_response = requests.post(security_endpoint, json={}, timeout=20)
-                    sec_data = sec_response.json()
+                    sec_data = post_scan(security_endpoint, refresh=refresh_security, timeout=30)
 
                     st.success("Security insights generated!")
+                    show_scan_age(sec_data)
+                    if sec_data.get("partial"):
+                        st.warning(f"⚠️ Partial results: did not finish in time: {', '.join(sec_data.get('unfinished_stages', []))}")
                     # st.markdown("### 🔍 Full API Raw Response")
                     # st.json(sec_data)
-                    if "summary" in sec_data:
+                    if sec_data.get("summary"):
                         st.markdown("### 🔍 AI Summary")
                         st.markdown(sec_data["summary"])
                     else:
@@ -223,15 +332,33 @@ with tab4:
 
                     if sec_data.get("public_s3_buckets"):
                         st.warning(f"📂 Public S3 Buckets: {len(sec_data['public_s3_buckets'])}")
-                        st.dataframe(pd.DataFrame(sec_data["public_s3_buckets"], columns=["BucketName"]))
+                        buckets_df = pd.DataFrame(sec_data["public_s3_buckets"])
+                        if "TriggeredBy" in buckets_df.columns:
+                            buckets_df["TriggeredBy"] = buckets_df["TriggeredBy"].apply(", ".join)
+                            st.dataframe(buckets_df[["BucketName", "TriggeredBy"]])
+                        else:
+                            st.dataframe(pd.DataFrame(sec_data["public_s3_buckets"], columns=["BucketName"]))
 
                     if sec_data.get("open_security_groups"):
                         st.error("🚨 Open Security Groups Detected")
-                        st.dataframe(pd.DataFrame(sec_data["open_security_groups"]))
+                        sgs_df = pd.DataFrame(sec_data["open_security_groups"])
+                        if "MatchedPorts" in sgs_df.columns:
+                            sgs_df["MatchedPorts"] = sgs_df["MatchedPorts"].apply(
+                                lambda matches: ", ".join(f"{m['Name']} ({m['Ports']}/{m['Protocol']})" for m in matches)
+                            )
+                            sgs_df["Sources"] = sgs_df["Sources"].apply(", ".join)
+                        st.dataframe(sgs_df)
 
                     if sec_data.get("risky_iam_users"):
                         st.warning("⚠️ IAM Users Without MFA or Admin Overexposure")
-                        st.dataframe(pd.DataFrame(sec_data["risky_iam_users"], columns=["IAM Username"]))
+                        users_df = pd.DataFrame(sec_data["risky_iam_users"])
+                        if "Reasons" in users_df.columns:
+                            users_df["Reasons"] = users_df["Reasons"].apply(", ".join)
+                            # MFA data can come from a credential report that is hours old
+                            columns = ["UserName", "Reasons"] + (["MfaCheckedAt"] if "MfaCheckedAt" in users_df.columns else [])
+                            st.dataframe(users_df[columns])
+                        else:
+                            st.dataframe(pd.DataFrame(sec_data["risky_iam_users"], columns=["IAM Username"]))
 
                 except Exception as e:
                     st.error("Failed to run security guard agent.")
@@ -250,15 +377,29 @@ with tab5:
                 import sys
                 root_path = Path(__file__).resolve().parent.parent.parent
                 sys.path.append(str(root_path))
-                from agents.infra_autopilot import generate_autopilot_summary
-                summaries = generate_autopilot_summary()
-
-                if not summaries:
-                    st.info("✅ No clear idle patterns detected.")
-                else:
-                    for group, advice in summaries:
+                from agents.infra_autopilot import iter_autopilot_stream
+
+                # Each log group gets its own section as soon as its summary starts streaming,
+                # and the text grows there as tokens arrive
+                progress = st.empty()
+                sections, texts, finished = {}, {}, 0
+                for group, chunk in iter_autopilot_stream():
+                    if group not in sections:
                         st.markdown(f"### 🔍 `{group}`")
-                        st.markdown(advice)
+                        sections[group], texts[group] = st.empty(), ""
+                    if chunk is None:
+                        finished += 1
+                        progress.caption(f"{finished} log group(s) analyzed so far...")
+                        sections[group].markdown(texts[group])
+                        continue
+                    texts[group] += chunk
+                    sections[group].markdown(texts[group] + " ▌")
+                progress.empty()
+                found = len(sections)
+
+                if not found:
+                    st.info("✅ No clear idle patterns detected.")
+                show_sonar_cache_stats()
 
             except Exception as e:
                 st.error("Autopilot Agent failed.")
@@ -288,6 +429,10 @@ with tab6:
                 try:
                     resp = requests.post(governance_endpoint, json={}, timeout=30)
                     data = resp.json()
+                    if data.get("partial"):
+                        st.warning(f"⚠️ Partial results: did not finish in time: {', '.join(data.get('unfinished_stages', []))}")
+                    for stage, error in data.get("stage_errors", {}).items():
+                        st.error(f"{stage} failed: {error}")
                     st.code(data.get("terraform", "No Terraform code returned."), language="hcl")
                 except Exception as e:
                     st.error("Failed to run Governance Copilot.")